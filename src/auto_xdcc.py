@@ -7,7 +7,6 @@ import hexchat
 import os
 import os.path
 import sys
-import shutil
 import logging
 import logging.handlers
 from time import sleep
@@ -19,11 +18,18 @@ import auto_xdcc.argparse as argparse
 # Best import error "solution" hue
 # pylint: disable=E0611
 import auto_xdcc.download_manager as dm
+import auto_xdcc.slot_budget as slot_budget
+import auto_xdcc.disk_space as disk_space
 import auto_xdcc.config
+from auto_xdcc.crc_verifier import CrcVerifier
+from auto_xdcc.file_mover import FileMover
 from auto_xdcc.printer import Printer, HexchatPrinter, TelegramBotPrinter
 from auto_xdcc.packlist_manager import PacklistManager
+from auto_xdcc.packlist import shutdown_parse_pool
 from auto_xdcc.packlist_item import PacklistItem
+from auto_xdcc.queue_journal import QueueJournal
 from auto_xdcc.timer import Timer
+from auto_xdcc.watchdog import DownloadWatchdog
 from auto_xdcc.telegram_bot import TelegramBot
 
 
@@ -76,6 +82,11 @@ packlist_manager = PacklistManager()
 packlist_manager.register_packlists()
 config.packlist_manager = packlist_manager
 
+queue_journal = QueueJournal(addons_path('xdcc_queue.journal'))
+restored = packlist_manager.restore_queue(queue_journal)
+if restored:
+    printer.info("Restored {} queued downloads.".format(restored))
+
 def printing_callback(userdata=None):
     printer.flush()
     return True
@@ -83,6 +94,25 @@ def printing_callback(userdata=None):
 printing_timer = Timer(200, printing_callback)
 printing_timer.register()
 
+def resume_deferred_callback(userdata=None):
+    resumed = sum(packlist.download_manager.resume_deferred() for packlist in packlist_manager.packlists.values())
+    if resumed:
+        printer.info("Disk space freed, resuming {} deferred downloads.".format(resumed))
+    return True
+
+resume_deferred_timer = Timer(60000, resume_deferred_callback)
+resume_deferred_timer.register()
+
+watchdog = DownloadWatchdog.from_config(packlist_manager, config.get('watchdog', {}))
+watchdog.register()
+config.watchdog = watchdog
+
+file_mover = FileMover.from_config(config.get('move', {}))
+
+# Completed downloads are only verified if the verify section is configured
+verifier = CrcVerifier.from_config(config['verify']) if 'verify' in config else None
+config.verifier = verifier
+
 
 # Download management
 def dcc_msg_block_cb(word, word_eol, userdata):
@@ -124,6 +154,15 @@ def dcc_send_offer_cb(word, word_eol, userdata):
         printer.info("DCC Send Offer received but sender {} is not trusted - DCC Offer not accepted.".format(bot_name))
         return hexchat.EAT_ALL
 
+    if state in (dm.DOWNLOAD_DEFERRED, dm.DOWNLOAD_REJECTED):
+        filesize, size_ext = _format_filesize(int(size))
+        if state == dm.DOWNLOAD_DEFERRED:
+            printer.info("Not enough disk space for {} ({} {}), deferring until space is freed.".format(filename, filesize, size_ext))
+        else:
+            printer.error("{} ({} {}) does not fit on disk, download cancelled.".format(filename, filesize, size_ext))
+        printer.flush()
+        return hexchat.EAT_ALL
+
     if type(item) == PacklistItem:
         filesize, size_ext = _format_filesize(int(size))
         printer.prog("Downloading {} - {:02d} ({} {}) from {}...".format(item.show_name, item.episode_nr, filesize, size_ext, bot_name))
@@ -137,6 +176,47 @@ def dcc_recv_connect_cb(word, word_eol, userdata):
     printer.flush()
     return hexchat.EAT_HEXCHAT
 
+def _update_episode(item):
+    shows = config['shows']
+    # The show may have been removed while the download was verified
+    if item.show_name not in shows:
+        return
+    prev_episode_nr = shows[item.show_name][0]
+    if prev_episode_nr is None or item.episode_nr > prev_episode_nr:
+        shows[item.show_name][0] = item.episode_nr
+        config.persist()
+
+def _move_completed(item, filename, subdir, key):
+    _update_episode(item)
+    if subdir:
+        src_dir = dm.get_dcc_completed_dir()
+        future = file_mover.submit(os.path.join(src_dir, filename), os.path.join(src_dir, subdir))
+        # Disk space stays reserved for the download until it has been moved
+        future.add_done_callback(lambda _future: disk_space.get().release(key))
+
+def _move_verified(item, filename, subdir, key):
+    printer.info("Verified {} ({:.1f} MB/s).".format(filename, verifier.throughput() / 1024**2))
+    _move_completed(item, filename, subdir, key)
+
+def _retry_corrupt(download_manager, task, filename, expected, actual):
+    item = task.item
+    disk_space.get().release(task.get_key())
+    download_manager.health.record_failure(task.bot_name)
+    if task.attempts >= verifier.max_retries:
+        printer.error("{} - {:02d} is corrupt (CRC32 {:08X}, expected {:08X}), giving up after {} attempts.".format(
+            item.show_name, item.episode_nr, actual, expected, task.attempts + 1
+        ))
+        return
+
+    try:
+        os.remove(os.path.join(dm.get_dcc_completed_dir(), filename))
+    except OSError as e:
+        logging.getLogger('crc_verifier').error("Could not remove %s", filename, exc_info=e)
+    printer.error("{} - {:02d} is corrupt (CRC32 {:08X}, expected {:08X}), downloading again.".format(
+        item.show_name, item.episode_nr, actual, expected
+    ))
+    download_manager.requeue(task)
+
 def dcc_recv_complete_cb(word, word_eol, userdata):
     [filename, _destination, _bot_name, time_spent] = word
 
@@ -149,7 +229,8 @@ def dcc_recv_complete_cb(word, word_eol, userdata):
         logger.error("Could not find a match for %s", filename)
         return hexchat.EAT_NONE
 
-    if packlist.download_manager.is_ongoing(filename):
+    task = packlist.download_manager.get_task(filename)
+    if task:
         item, size = packlist.download_manager.recv_complete_callback(filename)
     else:
         logger.error("Could not find a match for %s", filename)
@@ -161,21 +242,12 @@ def dcc_recv_complete_cb(word, word_eol, userdata):
         m, s = divmod(s, 60)
         h, m = divmod(m, 60)
 
-        [prev_episode_nr, _resolution, subdir] = config['shows'][item.show_name]
-        try:
-            if subdir:
-                src_dir = dm.get_dcc_completed_dir()
-                target_dir = os.path.join(src_dir, subdir)
-                if not os.path.exists(target_dir):
-                    os.mkdir(target_dir, mode=0o755)
-
-                shutil.move(os.path.join(src_dir, filename), os.path.join(target_dir, filename))
-        except:
-            pass
-
-        if prev_episode_nr is None or item.episode_nr > prev_episode_nr:
-            config['shows'][item.show_name][0] = item.episode_nr
-            config.persist()
+        subdir = config['shows'][item.show_name][2]
+        # The episode count only advances once the download is verified
+        verified = lambda: _move_verified(item, filename, subdir, task.get_key())
+        retry = lambda expected, actual: _retry_corrupt(packlist.download_manager, task, filename, expected, actual)
+        if not (verifier and verifier.submit(os.path.join(dm.get_dcc_completed_dir(), filename), filename, verified, retry)):
+            _move_completed(item, filename, subdir, task.get_key())
 
         printer.complete("Download complete - {} - {:02d} | Completed in {}:{:02}:{:02}".format(item.show_name, item.episode_nr, h, m, s))
         printer.x("{} downloads remaining.".format(
@@ -198,8 +270,10 @@ def dcc_recv_failed_cb(word, word_eol, userdata):
         return hexchat.EAT_NONE
 
     if packlist.download_manager.is_ongoing(filename):
-        packlist.download_manager.download_abort(bot_name, filename)
+        _task, requeued = packlist.download_manager.recv_failed_callback(bot_name, filename)
         logger.info("Aborting download of %s", filename)
+        if requeued:
+            printer.info("Retrying {} from another bot.".format(filename))
     else:
         logger.error("Could not find a match for %s", filename)
         return hexchat.EAT_NONE
@@ -262,9 +336,19 @@ def unloaded_cb(userdata):
         hexchat.command ("MENU DEL \"Auto XDCC\"")
     hexchat.set_pluginpref("menu_added",0)
 
+    watchdog.unregister()
+    file_mover.terminate()
+    if verifier:
+        verifier.terminate()
+
     # Force close running threads
     for packlist in packlist_manager.packlists.values():
         packlist.download_manager.terminate(True)
+    packlist_manager.terminate()
+    queue_journal.close()
+    shutdown_parse_pool()
+    slot_budget.get().reset()
+    disk_space.get().reset()
 
     if config.telegram_bot:
         config.telegram_bot.terminate(True)
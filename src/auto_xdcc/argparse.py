@@ -3,10 +3,13 @@ Wrapper for Python's argparse module
 """
 # pylint: disable=E0401
 import threading
+import time
 import hexchat
 import argparse as _argparse
 
 import auto_xdcc.config as gconfig
+import auto_xdcc.slot_budget as slot_budget
+import auto_xdcc.bot_health as bot_health
 from auto_xdcc.packlist_manager import PacklistManager
 from auto_xdcc.telegram_bot import TelegramBot
 from auto_xdcc.printer import AbstractPrinter, DirectPrinter, TelegramBotPrinter
@@ -217,6 +220,20 @@ def searchshow_handler(args):
         resolutions.sort()
         args.printer.list('#{}: {} - latest: {:02}, resolutions: {}'.format(global_idx, items[0].show_name, last_episode, ', '.join(map(str, resolutions))))
 
+    if args.fuzzy:
+        def run_thread():
+            ranked = config.packlist_manager.fuzzy_search(args.name, limit=args.count)
+            if ranked:
+                args.printer.x('Listing {} closest shows'.format(len(ranked)))
+                for _distance, items in ranked:
+                    _handle_search_items(items)
+                args.printer.info('Use "show add #1" to add first item in last search')
+            else:
+                args.printer.error('No shows found')
+
+        threading.Thread(target=run_thread).start()
+        return
+
     for packlist in config.packlist_manager.packlists.values():
         args.printer.info('Searching packlist {}'.format(packlist.name))
         def callback(matching):
@@ -230,7 +247,7 @@ def searchshow_handler(args):
                 args.printer.error('No shows found in {}'.format(packlist.name))
             print_lock.release()
 
-        packlist.search(args.name, callback)
+        packlist.search(args.name, callback, prefix=args.prefix)
 
 
 # Bot subcommand handlers
@@ -251,6 +268,18 @@ def getbot_handler(args):
     hexchat.command("MSG {} XDCC SEND {}".format(args.name, args.nr))
 
 
+def healthbots_handler(args):
+    health = bot_health.get()
+    scores = health.scores()
+    if not scores:
+        args.printer.x("No downloads recorded, all bots are considered healthy")
+        return
+
+    args.printer.x("Listing health of {} bots:".format(len(scores)))
+    for bot, score in sorted(scores.items(), key=lambda item: -item[1]):
+        args.printer.list("{}: {:.2f}{}".format(bot, score, '' if health.is_healthy(bot) else ' (avoided)'))
+
+
 def addbot_handler(args):
     config = gconfig.get()
     bots = set(config['trusted'])
@@ -281,17 +310,36 @@ def packlist_timer_handler(args):
     config = gconfig.get()
     if args.type == 'refresh':
         packlist = config.packlist_manager.packlists[args.packlist]
+        if args.status:
+            args.printer.x("Refresh timer of packlist {} runs with interval {}s{}.".format(
+                packlist, packlist.get_refresh_interval(), _adaptive_refresh_status(packlist)
+            ))
+            return
+
         packlist.refresh_timer.unregister()
         if args.off:
             args.printer.x("Refresh timer disabled for {}.".format(packlist))
         else:
             if args.interval:
-                packlist.refresh_interval = args.interval
+                packlist.set_refresh_interval(args.interval)
                 config['packlists'][packlist.name]['refreshInterval'] = args.interval
                 config.persist()
 
             packlist.register_refresh_timer(config.packlist_manager.refresh_timer_callback)
-            args.printer.x("Refresh timer enabled for packlist {} with interval {}s.".format(packlist, packlist.refresh_interval))
+            args.printer.x("Refresh timer enabled for packlist {} with interval {}s{}.".format(
+                packlist, packlist.get_refresh_interval(), _adaptive_refresh_status(packlist)
+            ))
+
+def _adaptive_refresh_status(packlist) -> str:
+    adaptive = packlist.adaptive_interval
+    if not adaptive:
+        return ''
+
+    status = " (adaptive {}-{}s".format(adaptive.min_interval, adaptive.max_interval)
+    last_change = adaptive.last_change()
+    if last_change:
+        status += ", last change {}".format(time.strftime('%Y-%m-%d %H:%M', time.localtime(last_change)))
+    return status + ")"
 
 
 def run_packlist_handler(args):
@@ -301,6 +349,83 @@ def run_packlist_handler(args):
     args.printer.x("Packlist '{}' check started".format(packlist))
 
 
+# Queue subcommand handlers
+def listqueue_handler(args):
+    config = gconfig.get()
+    total = 0
+    for packlist in config.packlist_manager.packlists.values():
+        tasks = packlist.download_manager.awaiting.ordered()
+        if not tasks:
+            continue
+
+        total += len(tasks)
+        args.printer.x("Listing {} queued downloads in {}:".format(len(tasks), packlist))
+        for idx, task in enumerate(tasks, 1):
+            item = task.item
+            args.printer.list("#{}: {} - {:02d} ({}) | priority {}".format(
+                idx, item.show_name, item.episode_nr, item.size, packlist.download_manager.awaiting.get_priority(item.show_name)
+            ))
+
+    if total == 0:
+        args.printer.x("No queued downloads")
+
+
+def priorityqueue_handler(args):
+    config = gconfig.get()
+    show_match = _match_show_name(config, args.printer, args.name)
+    if not show_match:
+        return
+
+    name, _data = show_match
+    priorities = config.setdefault('priorities', {})
+    if args.priority:
+        priorities[name] = args.priority
+    else:
+        priorities.pop(name, None)
+    config.persist()
+
+    args.printer.x("Updated {} download priority to {}.".format(name, args.priority))
+
+
+def orderqueue_handler(args):
+    config = gconfig.get()
+    config['smallestFirst'] = args.order == 'size'
+    config.persist()
+    for packlist in config.packlist_manager.packlists.values():
+        packlist.download_manager.awaiting.configure(config['priorities'], config['smallestFirst'])
+
+    if config['smallestFirst']:
+        args.printer.x("Shows of equal priority are downloaded smallest file first.")
+    else:
+        args.printer.x("Shows of equal priority take turns in downloads.")
+
+
+def slotsqueue_handler(args):
+    config = gconfig.get()
+    slots = slot_budget.get()
+    usage = slots.usage()
+
+    args.printer.x("Download slots in use: {} of {}, {} waiting".format(usage['total'], slots.total or 'unlimited', usage['waiting']))
+    for bot, count in sorted(usage['bots'].items()):
+        args.printer.list("Bot {}: {} of {}".format(bot, count, slots.bot_limit(bot) or 'unlimited'))
+    for packlist in config.packlist_manager.packlists.values():
+        args.printer.list("Packlist {}: {} of {}, {} reclaimed from stalled downloads".format(
+            packlist, usage['packlists'].get(packlist.name, 0), packlist.download_manager.concurrent_limit,
+            packlist.download_manager.reclaimed_slots
+        ))
+
+
+def verifyqueue_handler(args):
+    verifier = gconfig.get().verifier
+    if not verifier:
+        args.printer.x("Verification of completed downloads is not configured.")
+        return
+
+    args.printer.x("Verified {} downloads, {} corrupt, hashing at {:.1f} MB/s".format(
+        verifier.verified, verifier.mismatches, verifier.throughput() / 1024**2
+    ))
+
+
 def remotecontrol_link_handler(args):
     config = gconfig.get()
     if not args.token:
@@ -361,6 +486,13 @@ def show_options(parser):
     return parser
 
 
+def search_options(parser):
+    parser.add_argument('-p', '--prefix', help='Match only show names starting with the search', action='store_true')
+    parser.add_argument('-f', '--fuzzy', help='Rank show names of all packlists by similarity to the search', action='store_true')
+    parser.add_argument('-n', '--count', help='Number of results in fuzzy search', type=int, default=10)
+    return parser
+
+
 def listshows_subparser(parser):
     subparsers = parser.add_subparsers()
 
@@ -380,7 +512,7 @@ def shows_subparser(parser):
     show_main(subparsers.add_parser('remove', printer=parser.printer), removeshow_handler)
     show_main(subparsers.add_parser('archive', printer=parser.printer), archiveshow_handler)
     show_main(subparsers.add_parser('restore', printer=parser.printer), restoreshow_handler)
-    show_main(subparsers.add_parser('search', printer=parser.printer), searchshow_handler)
+    search_options(show_main(subparsers.add_parser('search', printer=parser.printer), searchshow_handler))
 
     return general_main(parser)
 
@@ -400,6 +532,7 @@ def bots_subparser(parser):
 
     list_parser = subparsers.add_parser('list', printer=parser.printer)
     list_parser.set_defaults(handler=listbots_handler)
+    general_main(subparsers.add_parser('health', printer=parser.printer), healthbots_handler)
 
     getbot_options(bot_main(subparsers.add_parser('get', printer=parser.printer), getbot_handler))
     bot_main(subparsers.add_parser('add', printer=parser.printer), addbot_handler)
@@ -412,6 +545,7 @@ def timer_main(parser, handler):
     parser.add_argument('type', help='Which timer', choices=('refresh',))
     parser.add_argument('--off', help='Disable the timer until restart', action='store_true')
     parser.add_argument('-i', '--interval', help='Interval to run timer at in seconds', type=int)
+    parser.add_argument('-s', '--status', help='Show the current interval of the timer', action='store_true')
 
     return general_main(parser, handler)
 
@@ -429,6 +563,24 @@ def packlist_subparser(parser: ArgumentParser, packlist_manager: PacklistManager
     return general_main(parser)
 
 
+def queue_subparser(parser):
+    subparsers = parser.add_subparsers()
+
+    general_main(subparsers.add_parser('list', printer=parser.printer), listqueue_handler)
+    general_main(subparsers.add_parser('slots', printer=parser.printer), slotsqueue_handler)
+    general_main(subparsers.add_parser('verify', printer=parser.printer), verifyqueue_handler)
+
+    priority_parser = subparsers.add_parser('priority', printer=parser.printer)
+    priority_parser.add_argument('priority', help='Priority of the show, higher is downloaded first, default 0', type=int)
+    show_main(priority_parser, priorityqueue_handler)
+
+    order_parser = subparsers.add_parser('order', printer=parser.printer)
+    order_parser.add_argument('order', help='Order of shows with equal priority', choices=('turns', 'size'))
+    general_main(order_parser, orderqueue_handler)
+
+    return general_main(parser, listqueue_handler)
+
+
 def remotecontrol_link_main(parser):
     parser.add_argument('token', help='API token of the bot', nargs='?')
     return general_main(parser, remotecontrol_link_handler)
@@ -451,6 +603,7 @@ def create_argument_parser(printer: AbstractPrinter, prog='/axdcc'):
     shows_subparser(subparsers.add_parser('show', printer=parser.printer))
     bots_subparser(subparsers.add_parser('bot', printer=parser.printer))
     packlist_subparser(subparsers.add_parser('packlist', printer=parser.printer, aliases=['pl']), gconfig.get().packlist_manager)
+    queue_subparser(subparsers.add_parser('queue', printer=parser.printer))
     remotecontrol_subparser(subparsers.add_parser('remotecontrol', printer=parser.printer, aliases=['rc']))
 
     parser.set_defaults(parser=parser, printer=direct_printer)
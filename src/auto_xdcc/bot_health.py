@@ -0,0 +1,40 @@
+import threading
+from typing import Dict
+
+
+class BotHealth:
+    """
+    Health score of each bot between 0 and 1, an exponentially weighted average of download outcomes.
+    Bots without recorded outcomes are considered healthy.
+    """
+    def __init__(self, weight: float = 0.3, threshold: float = 0.4):
+        self.weight = weight
+        self.threshold = threshold
+        self._scores: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def score(self, bot_name: str) -> float:
+        return self._scores.get(bot_name, 1.0)
+
+    def _record(self, bot_name: str, outcome: float):
+        with self.lock:
+            self._scores[bot_name] = (1 - self.weight) * self.score(bot_name) + self.weight * outcome
+
+    def record_success(self, bot_name: str):
+        self._record(bot_name, 1.0)
+
+    def record_failure(self, bot_name: str):
+        self._record(bot_name, 0.0)
+
+    def is_healthy(self, bot_name: str) -> bool:
+        return self.score(bot_name) >= self.threshold
+
+    def scores(self) -> Dict[str, float]:
+        with self.lock:
+            return dict(self._scores)
+
+
+health = BotHealth()
+
+def get() -> BotHealth:
+    return health
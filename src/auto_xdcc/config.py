@@ -7,6 +7,8 @@ class Config(collections.UserDict):
     packlist_manager = None
     printer = None
     telegram_bot = None
+    watchdog = None
+    verifier = None
 
     def __init__(self, path):
         self.path = path
@@ -0,0 +1,96 @@
+import logging
+import time
+import zlib
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+from auto_xdcc.packlist_parser import parse_crc32
+from auto_xdcc.worker_pool import WorkerPool
+
+
+class CrcVerifier(WorkerPool):
+    """
+    Checks completed downloads against the CRC32 in their filename, e.g. [ABCD1234], in worker threads.
+    Files are hashed in reads of buffer_size into a reused buffer.
+    """
+    def __init__(self, workers: int = 1, buffer_size: int = 4 * 1024**2, max_retries: int = 3):
+        super().__init__(workers, 'crc_verifier')
+        self.buffer_size = buffer_size
+        self.max_retries = max_retries
+        self.hashed_bytes = 0
+        self.hashing_time = 0.0
+        self.verified = 0
+        self.mismatches = 0
+        self.logger = logging.getLogger('crc_verifier')
+
+    @classmethod
+    def from_config(cls, config: dict):
+        keys = {'workers': 'workers', 'bufferSize': 'buffer_size', 'maxRetries': 'max_retries'}
+        return cls(**{keys[key]: value for key, value in config.items() if key in keys})
+
+    def throughput(self) -> float:
+        """
+        Returns: average hashing speed in bytes per second
+        """
+        with self.lock:
+            return self.hashed_bytes / self.hashing_time if self.hashing_time else 0.0
+
+    def checksum(self, path: str) -> int:
+        buffer = bytearray(self.buffer_size)
+        view = memoryview(buffer)
+        crc = 0
+        size = 0
+        started = time.monotonic()
+        with open(path, 'rb', buffering=0) as f:
+            while not self.stopping.is_set():
+                read = f.readinto(buffer)
+                if not read:
+                    break
+                crc = zlib.crc32(view[:read], crc)
+                size += read
+        if self.stopping.is_set():
+            raise InterruptedError(0, 'Interrupted by unload')
+
+        with self.lock:
+            self.hashed_bytes += size
+            self.hashing_time += time.monotonic() - started
+        return crc
+
+    def submit(self, path: str, filename: str, on_match: Callable[[], None], on_mismatch: Callable[[int, int], None]) -> Optional[Future]:
+        """
+        Verifies path in the background. on_match is also called if the file could not be read.
+        on_mismatch is called with the expected and the actual CRC32.
+
+        Returns: future of the check, None if filename has no CRC32
+        """
+        expected = parse_crc32(filename)
+        if expected is None:
+            return None
+        future = self._submit(self._verify, path, expected, on_match, on_mismatch)
+        future.add_done_callback(lambda f: self._log_error(f, path))
+        return future
+
+    def _log_error(self, future: Future, path: str):
+        if not future.cancelled() and future.exception():
+            self.logger.error("Verifying %s failed", path, exc_info=future.exception())
+
+    def _verify(self, path: str, expected: int, on_match: Callable[[], None], on_mismatch: Callable[[int, int], None]):
+        try:
+            actual = self.checksum(path)
+        except InterruptedError:
+            return
+        except OSError as e:
+            self.logger.error("Could not verify %s", path, exc_info=e)
+            on_match()
+            return
+
+        if actual == expected:
+            self.logger.info("CRC32 of %s matches", path)
+            with self.lock:
+                self.verified += 1
+            on_match()
+        else:
+            self.logger.warning("CRC32 of %s is %08X, expected %08X", path, actual, expected)
+            with self.lock:
+                self.mismatches += 1
+            on_mismatch(expected, actual)
@@ -0,0 +1,129 @@
+import os
+import shutil
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+
+class DiskSpace:
+    """
+    Space reserved on disk for accepted downloads, so concurrent downloads do not fill the disk together.
+    Reservations shrink by the bytes already written to their partial file on the same device.
+    A margin of free space is kept on every device.
+    """
+    def __init__(self, margin: int = 256 * 1024**2):
+        self.margin = margin
+        # Key -> (size, partial file path, reserved directories by device)
+        self.reservations: Dict[str, Tuple[int, str, Dict[int, str]]] = {}
+        self.lock = threading.Lock()
+
+    def configure(self, margin: int):
+        with self.lock:
+            self.margin = margin
+
+    @staticmethod
+    def _existing(path: str) -> str:
+        """
+        Returns: path or its nearest existing parent
+        """
+        while not os.path.exists(path):
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+        return path
+
+    @staticmethod
+    def devices(dirs: Iterable[str]) -> Dict[int, str]:
+        """
+        Returns: one existing directory for each device of dirs
+        """
+        devices = {}
+        for directory in dirs:
+            directory = DiskSpace._existing(directory)
+            devices.setdefault(os.stat(directory).st_dev, directory)
+        return devices
+
+    def _reserved(self, device: int) -> int:
+        reserved = 0
+        for size, partial_path, devices in self.reservations.values():
+            if device not in devices:
+                continue
+            try:
+                stat = os.stat(partial_path)
+                written = stat.st_size if stat.st_dev == device else 0
+            except OSError:
+                written = 0
+            reserved += max(size - written, 0)
+        return reserved
+
+    def _fits(self, devices: Dict[int, str], size: int) -> bool:
+        return all(
+            shutil.disk_usage(directory).free - self._reserved(device) - self.margin >= size
+            for device, directory in devices.items()
+        )
+
+    def fits(self, dirs: Iterable[str], size: int) -> bool:
+        """
+        Returns: True if size bytes fit in each of dirs next to the reserved space
+        """
+        if not size:
+            return True
+        with self.lock:
+            return self._fits(DiskSpace.devices(dirs), size)
+
+    def can_ever_fit(self, dirs: Iterable[str], size: int) -> bool:
+        """
+        Returns: False if size bytes would not fit in dirs even on empty disks
+        """
+        return all(shutil.disk_usage(directory).total - self.margin >= size for directory in DiskSpace.devices(dirs).values())
+
+    def reserve(self, key: str, dirs: Iterable[str], size: int, partial_path: str) -> bool:
+        """
+        Returns: False if size bytes do not fit in each of dirs
+        """
+        if not size:
+            return True
+        with self.lock:
+            devices = DiskSpace.devices(dirs)
+            if not self._fits(devices, size):
+                return False
+            self.reservations[key] = (size, partial_path, devices)
+            return True
+
+    def settle(self, key: str, path: str, pending_dirs: List[str]):
+        """
+        Keeps the reservation of a completed file at path only on devices of pending_dirs it is still moved to
+        """
+        with self.lock:
+            reservation = self.reservations.pop(key, None)
+            if reservation is None or not pending_dirs:
+                return
+            try:
+                device = os.stat(path).st_dev
+            except OSError:
+                return
+
+            devices = {
+                other: directory for other, directory in DiskSpace.devices(pending_dirs).items() if other != device
+            }
+            if devices:
+                # Partial file of FileMover copying across devices
+                partial_path = os.path.join(pending_dirs[0], os.path.basename(path) + '.part')
+                self.reservations[key] = (reservation[0], partial_path, devices)
+
+    def release(self, key: str):
+        with self.lock:
+            self.reservations.pop(key, None)
+
+    def reset(self):
+        """
+        Forgets all reservations. The reservations outlive plugin reloads, which drop the tasks holding them.
+        """
+        with self.lock:
+            self.reservations.clear()
+
+
+space = DiskSpace()
+
+def get() -> DiskSpace:
+    return space
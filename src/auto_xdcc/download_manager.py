@@ -2,15 +2,23 @@ import threading
 import queue
 import logging
 import os.path
-from typing import Optional
+import time
+from typing import Callable, List, Optional, Tuple
 
 # pylint: disable=E0401
 import hexchat
 
 from auto_xdcc.thread_runner import ThreadRunner
+from auto_xdcc.download_scheduler import DownloadScheduler
+import auto_xdcc.slot_budget as slot_budget
+import auto_xdcc.bot_health as bot_health
+import auto_xdcc.disk_space as disk_space
+import auto_xdcc.queue_journal as queue_journal
 from auto_xdcc.packlist_item import PacklistItem
-from auto_xdcc.util import get_dcc_completed_dir, is_modified_filename
+from auto_xdcc.util import get_dcc_completed_dir, is_modified_filename, normalize_filename
 
+DOWNLOAD_REJECTED = -3
+DOWNLOAD_DEFERRED = -2
 DOWNLOAD_ABORT = -1
 DOWNLOAD_AWAITING = 0
 DOWNLOAD_REQUEST = 1
@@ -18,6 +26,19 @@ DOWNLOAD_CONNECT = 2
 DOWNLOAD_COMPLETE = 10
 
 
+def format_pack_ranges(packnumbers: List[int]) -> str:
+    """
+    Returns: pack numbers as comma separated ranges, e.g. 1-3,7
+    """
+    ranges = []
+    for packnumber in sorted(set(packnumbers)):
+        if ranges and packnumber == ranges[-1][1] + 1:
+            ranges[-1][1] = packnumber
+        else:
+            ranges.append([packnumber, packnumber])
+    return ','.join(str(start) if start == end else '{}-{}'.format(start, end) for start, end in ranges)
+
+
 class DownloadManager(ThreadRunner):
     class Task:
         def __init__(self, bot_name, item, task_type='regular', status=DOWNLOAD_AWAITING, filesize=None):
@@ -28,6 +49,18 @@ class DownloadManager(ThreadRunner):
             self.filesize = filesize
             self.filename = ''
             self.completion_event = threading.Event()
+            self.done_callbacks = []
+            # (packlist name, bot name) of the shared download slot held by the task
+            self.slot = None
+            self.state_since = time.monotonic()
+            # (received bytes, time) of the last observed transfer progress
+            self.progress = None
+            self.attempts = 0
+            # Pack number on bot_name, which may differ from the item's after a failover
+            self.packnumber = item.packnumber if type(item) == PacklistItem else None
+            self.failed_bots = set()
+            # Tasks requested together with this one in a single XDCC BATCH
+            self.batch = []
 
         def __str__(self):
             if type(self.item) == PacklistItem:
@@ -48,15 +81,51 @@ class DownloadManager(ThreadRunner):
         def get_filepath(self) -> str:
             return os.path.join(get_dcc_completed_dir(), self.get_filename())
 
+        def is_batch_waiting(self) -> bool:
+            """
+            Returns: True if the bot is sending another pack of the task's batch
+            """
+            return any(task is not self and task.status == DOWNLOAD_CONNECT for task in self.batch)
+
         def is_complete(self) -> bool:
             return self.status == DOWNLOAD_COMPLETE
 
-    def __init__(self, concurrent_downloads, trusted_bots):
+        def set_status(self, status: int):
+            self.status = status
+            self.state_since = time.monotonic()
+
+        def done(self, status: int):
+            self.set_status(status)
+            self.completion_event.set()
+            for callback in self.done_callbacks:
+                callback(self)
+
+    def __init__(self, concurrent_downloads, trusted_bots, name='', slots: Optional[slot_budget.SlotBudget] = None):
+        self.name = name
+        self.concurrent_limit = concurrent_downloads
         self.concurrent_downloads = threading.Semaphore(concurrent_downloads)
+        self.slots = slots or slot_budget.get()
         self.trusted_bots = trusted_bots
-        self.awaiting = queue.Queue()
+        self.awaiting = DownloadScheduler()
         self.ongoing = {}
+        # Normalized filename -> key of ongoing task
+        self.ongoing_index = {}
         self.ongoing_lock = threading.Lock()
+        self.reclaimed_slots = 0
+        self.health = bot_health.get()
+        # Returns (bot name, pack number) sources of an item, the packlist's own bot first
+        self.router: Optional[Callable[[PacklistItem], List[Tuple[str, int]]]] = None
+        self.journal: Optional[queue_journal.QueueJournal] = None
+        self.disk_space = disk_space.get()
+        # Returns the directories an item is stored in after completion
+        self.target_dirs: Optional[Callable[[PacklistItem], List[str]]] = None
+        # Tasks whose offers did not fit on disk, waiting for free space
+        self.deferred: List[DownloadManager.Task] = []
+        self.deferred_lock = threading.Lock()
+        # Bots supporting XDCC BATCH, which get up to batch_size packs at most batch_window apart in one request
+        self.batch_bots = set()
+        self.batch_size = 5
+        self.batch_window = 100
         self._thread = self.create_thread()
         self.request_list_task = None
         super().__init__(logging.getLogger('download_manager'))
@@ -78,23 +147,42 @@ class DownloadManager(ThreadRunner):
                 break
 
             self.concurrent_downloads.acquire()
+            self.route(task)
+
+            # Wait for a slot shared with other download managers
+            acquired = False
+            while not (acquired or self._thread_stop):
+                acquired = self.slots.acquire(self.name, task.bot_name, timeout=5)
 
             if self._thread_stop:
+                if acquired:
+                    self.slots.release(self.name, task.bot_name)
                 self.concurrent_downloads.release()
                 break
 
-            logger.debug("Sending download request for %s", task.get_key())
-            self.download_request(task)
+            task.slot = (self.name, task.bot_name)
+
+            batch = self.gather_batch(task) if task.bot_name in self.batch_bots else []
+            if batch:
+                logger.debug("Sending batch request for %s and %d more", task.get_key(), len(batch))
+                self.batch_request([task] + batch)
+            else:
+                logger.debug("Sending download request for %s", task.get_key())
+                self.download_request(task)
 
         logger.debug("Closing download manager thread")
 
     def count_awaiting(self):
-        return self.awaiting.qsize()
+        return self.awaiting.qsize() + len(self.deferred)
 
     def count_ongoing(self):
         return len(self.ongoing)
 
-    def get_task(self, filename: str) -> Optional[Task]:
+    def get_task(self, filename: str, fuzzy: bool = True) -> Optional[Task]:
+        """
+        Finds the ongoing task of a possibly rewritten filename.
+        Edit distance to each ongoing filename is only checked if fuzzy is set and the normalized filename is unknown.
+        """
         if filename in self.ongoing:
             return self.ongoing[filename]
         elif 'xdcc.txt' in filename:
@@ -103,41 +191,256 @@ class DownloadManager(ThreadRunner):
                     task.filename = filename
                     return task
         else:
-            for download in self.ongoing:
-                if is_modified_filename(download, filename):
-                    return self.ongoing[download]
+            key = self.ongoing_index.get(normalize_filename(filename))
+            if key is not None and key in self.ongoing:
+                return self.ongoing[key]
+
+            if fuzzy:
+                for download in list(self.ongoing):
+                    if is_modified_filename(download, filename):
+                        return self.ongoing[download]
         return None
 
+    def _remove_ongoing(self, task: Task):
+        key = task.get_key()
+        del self.ongoing[key]
+        normalized = normalize_filename(key)
+        if self.ongoing_index.get(normalized) == key:
+            del self.ongoing_index[normalized]
+
     def is_ongoing(self, filename):
         return self.get_task(filename) is not None
 
+    def _journal(self, event: str, task: Task):
+        if self.journal and task.task_type == 'regular':
+            self.journal.record(event, self.name, task.bot_name, task.item, task.filesize)
+
     def queue_download(self, bot_name, item):
         task = DownloadManager.Task(bot_name, item)
+        self._journal(queue_journal.QUEUED, task)
         self.awaiting.put(task)
 
-    def finish_task(self, filename):
+    def finish_task(self, filename, status=DOWNLOAD_COMPLETE):
         with self.ongoing_lock:
             task = self.get_task(filename)
-            task.status = DOWNLOAD_COMPLETE
-            task.completion_event.set()
-            del self.ongoing[task.get_key()]
-            if task.task_type == 'regular':
-                self.concurrent_downloads.release()
+            self._remove_ongoing(task)
+            self._release_slot(task)
+            self._release_space(task, status)
             self.logger.debug("Finishing task for %s", task)
+        self._journal(queue_journal.COMPLETED if status == DOWNLOAD_COMPLETE else queue_journal.ABORTED, task)
+        task.done(status)
         return task
 
+    def _release_slot(self, task: Task):
+        if task.task_type == 'regular':
+            self.concurrent_downloads.release()
+        if task.slot:
+            self.slots.release(*task.slot)
+            task.slot = None
+
+    def _release_space(self, task: Task, status: int):
+        if status == DOWNLOAD_COMPLETE:
+            # Moving the file into its target directory may still need space on another device
+            self.disk_space.settle(task.get_key(), task.get_filepath(), self._target_dirs(task)[1:])
+        else:
+            self.disk_space.release(task.get_key())
+
+    def expire_task(self, task: Task) -> bool:
+        """
+        Cancels a task which has not completed in time.
+
+        Returns: False if the task has already finished
+        """
+        with self.ongoing_lock:
+            if self.ongoing.get(task.get_key()) is not task:
+                return False
+            self._remove_ongoing(task)
+            self._release_slot(task)
+            self._release_space(task, DOWNLOAD_ABORT)
+            self.logger.debug("Expiring task for %s", task)
+        self._journal(queue_journal.ABORTED, task)
+        hexchat.command("MSG {} XDCC CANCEL".format(task.bot_name))
+        task.done(DOWNLOAD_ABORT)
+        return True
+
+    def reclaim_task(self, task: Task) -> bool:
+        """
+        Cancels a stalled task to free its download slot.
+
+        Returns: False if the task has already finished
+        """
+        if not self.expire_task(task):
+            return False
+        self.reclaimed_slots += 1
+        self.health.record_failure(task.bot_name)
+        return True
+
+    def requeue(self, task: Task):
+        new_task = DownloadManager.Task(task.bot_name, task.item)
+        new_task.packnumber = task.packnumber
+        new_task.attempts = task.attempts + 1
+        new_task.failed_bots = task.failed_bots | {task.bot_name}
+        self._journal(queue_journal.QUEUED, new_task)
+        self.awaiting.put(new_task)
+        self.start()
+
+    def sources(self, task: Task) -> List[Tuple[str, int]]:
+        if self.router is None or type(task.item) != PacklistItem:
+            return [(task.bot_name, task.packnumber)]
+        # Unique sources in order of preference
+        return list(dict.fromkeys(self.router(task.item))) or [(task.bot_name, task.packnumber)]
+
+    def has_alternative(self, task: Task) -> bool:
+        return any(bot not in task.failed_bots and bot != task.bot_name for bot, _packnumber in self.sources(task))
+
+    def route(self, task: Task):
+        """
+        Sends the task to a source bot, preferring bots which have not failed the task,
+        have free download slots and are healthy, in that order.
+        Otherwise the packlist's own bot and its mirrors go first.
+        """
+        sources = self.sources(task)
+        candidates = [source for source in sources if source[0] not in task.failed_bots] or sources
+        bot_name, packnumber = min(candidates, key=lambda source: (
+            not self.slots.has_capacity(source[0]), not self.health.is_healthy(source[0])
+        ))
+        if bot_name != task.bot_name:
+            self.logger.info("Routing %s to %s #%d instead of %s", task.get_key(), bot_name, packnumber, task.bot_name)
+        task.bot_name = bot_name
+        task.packnumber = packnumber
+
+    def _batch_packnumber(self, task: Task, bot_name: str, near: int) -> Optional[int]:
+        for source_bot, packnumber in self.sources(task):
+            if source_bot == bot_name and source_bot not in task.failed_bots and abs(packnumber - near) <= self.batch_window:
+                return packnumber
+        return None
+
+    def gather_batch(self, head: Task) -> List[Task]:
+        """
+        Takes awaiting tasks which head's bot offers near head's pack number, as long as download slots are free.
+
+        Returns: taken tasks, routed to head's bot and holding their download slots
+        """
+        batch = []
+        while len(batch) < self.batch_size - 1:
+            if not self.concurrent_downloads.acquire(blocking=False):
+                break
+            if not self.slots.acquire(self.name, head.bot_name, timeout=0):
+                self.concurrent_downloads.release()
+                break
+
+            tasks = self.awaiting.take(lambda task: self._batch_packnumber(task, head.bot_name, head.packnumber) is not None, 1)
+            if not tasks:
+                self.slots.release(self.name, head.bot_name)
+                self.concurrent_downloads.release()
+                break
+
+            task = tasks[0]
+            task.packnumber = self._batch_packnumber(task, head.bot_name, head.packnumber)
+            task.bot_name = head.bot_name
+            task.slot = (self.name, head.bot_name)
+            batch.append(task)
+        return batch
+
+    def _target_dirs(self, task: Task) -> List[str]:
+        if self.target_dirs is None or type(task.item) != PacklistItem:
+            return [get_dcc_completed_dir()]
+        return self.target_dirs(task.item)
+
+    def _space_dirs(self, task: Task) -> List[str]:
+        # Hexchat writes the partial file to dcc_dir, which may be on another device
+        return [hexchat.get_prefs('dcc_dir')] + self._target_dirs(task)
+
+    def _admit(self, task: Task) -> bool:
+        """
+        Reserves disk space for an offered file in the DCC, completed and the task's target directories.
+
+        Returns: False if the file does not fit
+        """
+        if task.task_type != 'regular':
+            return True
+        partial_path = os.path.join(hexchat.get_prefs('dcc_dir'), task.filename)
+        return self.disk_space.reserve(task.get_key(), self._space_dirs(task), task.filesize, partial_path)
+
+    def _refuse_offer(self, dcc_bot_name: str, task: Task) -> int:
+        """
+        Refuses an offer which does not fit on disk. The task waits for free space unless the file could never fit.
+
+        Returns: DOWNLOAD_DEFERRED or DOWNLOAD_REJECTED
+        """
+        hexchat.command("DCC CLOSE GET {} {}".format(dcc_bot_name, task.filename))
+        hexchat.command("MSG {} XDCC CANCEL".format(dcc_bot_name))
+        if not self.disk_space.can_ever_fit(self._space_dirs(task), task.filesize):
+            self.logger.warning("Rejecting %s, %d bytes never fit on disk", task.get_key(), task.filesize)
+            self.finish_task(task.get_key(), status=DOWNLOAD_ABORT)
+            return DOWNLOAD_REJECTED
+
+        self.logger.info("Deferring %s until %d bytes are free", task.get_key(), task.filesize)
+        with self.ongoing_lock:
+            if self.ongoing.get(task.get_key()) is task:
+                self._remove_ongoing(task)
+                self._release_slot(task)
+                self._release_space(task, DOWNLOAD_ABORT)
+        task.set_status(DOWNLOAD_AWAITING)
+        task.batch = []
+        with self.deferred_lock:
+            self.deferred.append(task)
+        self._journal(queue_journal.QUEUED, task)
+        return DOWNLOAD_DEFERRED
+
+    def resume_deferred(self) -> int:
+        """
+        Queues tasks deferred for disk space again once their files fit.
+
+        Returns: number of resumed tasks
+        """
+        resumed = []
+        with self.deferred_lock:
+            pending = 0
+            for task in self.deferred:
+                if self.disk_space.fits(self._space_dirs(task), pending + task.filesize):
+                    pending += task.filesize
+                    resumed.append(task)
+            self.deferred = [task for task in self.deferred if task not in resumed]
+
+        for task in resumed:
+            self.awaiting.put(task)
+        if resumed:
+            self.start()
+        return len(resumed)
+
+    def ongoing_tasks(self) -> list:
+        with self.ongoing_lock:
+            return list(self.ongoing.values())
+
     def _download_task(self, task: Task):
-        task.status = DOWNLOAD_REQUEST
+        task.set_status(DOWNLOAD_REQUEST)
         with self.ongoing_lock:
             self.ongoing[task.get_key()] = task
+            self.ongoing_index[normalize_filename(task.get_key())] = task.get_key()
 
     def download_request(self, task: Task):
         self._download_task(task)
-        hexchat.command("MSG {} XDCC SEND {}".format(task.bot_name, task.item.packnumber))
+        self._journal(queue_journal.REQUESTED, task)
+        hexchat.command("MSG {} XDCC SEND {}".format(task.bot_name, task.packnumber))
         return task
 
-    def request_list(self, bot_name: str, packlist_name: str):
+    def batch_request(self, tasks: List[Task]):
+        """
+        Requests packs of several tasks from the same bot at once.
+        Offers are matched to the tasks by filename like those of single requests.
+        """
+        for task in tasks:
+            task.batch = tasks
+            self._download_task(task)
+            self._journal(queue_journal.REQUESTED, task)
+        hexchat.command("MSG {} XDCC BATCH {}".format(tasks[0].bot_name, format_pack_ranges([task.packnumber for task in tasks])))
+        return tasks
+
+    def request_list(self, bot_name: str, packlist_name: str, on_done=None):
         task = DownloadManager.Task(bot_name, packlist_name, task_type='packlist')
+        if on_done:
+            task.done_callbacks.append(on_done)
         self._download_task(task)
         hexchat.command("MSG {} XDCC SEND LIST".format(task.bot_name))
         self.logger.debug('Requesting packlist from %s', task.bot_name)
@@ -145,31 +448,54 @@ class DownloadManager(ThreadRunner):
 
     def download_abort(self, dcc_bot_name, filename):
         hexchat.emit_print("DCC RECV Abort", dcc_bot_name, filename)
-        task = self.finish_task(filename)
-        task.status = DOWNLOAD_ABORT
-        task.completion_event.set()
+        task = self.finish_task(filename, status=DOWNLOAD_ABORT)
         hexchat.command("MSG {} XDCC CANCEL".format(task.bot_name))
         return task
 
     def send_offer_callback(self, dcc_bot_name, filename, filesize, ip_addr):
-        if dcc_bot_name in self.trusted_bots:
-            with self.ongoing_lock:
-                task = self.get_task(filename)
+        with self.ongoing_lock:
+            task = self.get_task(filename)
 
+            # Bots failed over to are trusted for their task
+            trusted = dcc_bot_name in self.trusted_bots or (task and task.bot_name == dcc_bot_name)
+            if trusted:
                 if task:
                     self.logger.debug('Found task %s for filename %s', str(task), filename)
-                    hexchat.emit_print("DCC RECV Connect", dcc_bot_name, ip_addr, filename)
                     task.filename = filename
                     task.filesize = filesize
-                    task.status = DOWNLOAD_CONNECT
-                    return (DOWNLOAD_CONNECT, task.item)
+                    if self._admit(task):
+                        hexchat.emit_print("DCC RECV Connect", dcc_bot_name, ip_addr, filename)
+                        task.set_status(DOWNLOAD_CONNECT)
+                        self._journal(queue_journal.CONNECTED, task)
+                        return (DOWNLOAD_CONNECT, task.item)
                 else:
                     self.logger.error('No task for filename %s', filename)
-            return (None, None)
+                    return (None, None)
+
+        if trusted:
+            return (self._refuse_offer(dcc_bot_name, task), task.item)
 
         task = self.download_abort(dcc_bot_name, filename)
         return (DOWNLOAD_ABORT, task.item)
 
     def recv_complete_callback(self, filename):
         task = self.finish_task(filename)
+        if task.task_type == 'regular':
+            self.health.record_success(task.bot_name)
         return (task.item, task.filesize)
+
+    def recv_failed_callback(self, dcc_bot_name, filename):
+        """
+        Aborts a failed download and queues it again for another bot offering the same file, if there is one.
+
+        Returns: aborted task and whether it was queued again
+        """
+        task = self.download_abort(dcc_bot_name, filename)
+        if task.task_type != 'regular':
+            return (task, False)
+
+        self.health.record_failure(task.bot_name)
+        if not self.has_alternative(task):
+            return (task, False)
+        self.requeue(task)
+        return (task, True)
@@ -0,0 +1,139 @@
+import heapq
+import itertools
+import queue
+import re
+import threading
+from typing import Dict, List, Optional
+
+from auto_xdcc.packlist_item import PacklistItem
+
+
+def size_to_bytes(size: Optional[str]) -> float:
+    """
+    Converts packlist sizes like '350M' or '1.2G' to bytes, unknown sizes sort last
+    """
+    match = re.fullmatch(r'([0-9.]+)\s*([KMG]?)', (size or '').strip())
+    if not match:
+        return float('inf')
+    try:
+        value = float(match.group(1))
+    except ValueError:
+        return float('inf')
+    return value * 1024**' KMG'.index(match.group(2) or ' ')
+
+
+class DownloadScheduler:
+    """
+    Queue of awaiting download tasks with the blocking get of queue.Queue.
+    Shows with a higher priority go first. Shows of equal priority take turns,
+    or if smallest_first is set, the show with the smallest next file goes first.
+    Within a show the oldest episode goes first.
+    """
+    def __init__(self, priorities: Optional[Dict[str, int]] = None, smallest_first: bool = False):
+        # Show name -> priority, shows not in it have priority 0
+        self.priorities = priorities if priorities is not None else {}
+        self.smallest_first = smallest_first
+        # Show name -> heap of (episode_nr, sequence, task)
+        self.shows: Dict[str, list] = {}
+        # Show name -> sequence number of its last dequeued task
+        self.turns: Dict[str, int] = {}
+        self.sequence = itertools.count()
+        self.size = 0
+        self.condition = threading.Condition()
+
+    @staticmethod
+    def show_of(task) -> str:
+        if type(task.item) == PacklistItem:
+            return task.item.show_name
+        return ''
+
+    def get_priority(self, show_name: str) -> int:
+        return self.priorities.get(show_name, 0)
+
+    def configure(self, priorities: Dict[str, int], smallest_first: bool):
+        with self.condition:
+            self.priorities = priorities
+            self.smallest_first = smallest_first
+
+    def put(self, task):
+        episode_nr = task.item.episode_nr if type(task.item) == PacklistItem else 0
+        with self.condition:
+            heapq.heappush(self.shows.setdefault(DownloadScheduler.show_of(task), []), (episode_nr, next(self.sequence), task))
+            self.size += 1
+            self.condition.notify()
+
+    def _show_order(self, show_name: str, heap: list, turns: Dict[str, int]) -> tuple:
+        _episode_nr, sequence, task = heap[0]
+        if self.smallest_first:
+            turn = size_to_bytes(task.item.size) if type(task.item) == PacklistItem else 0
+        else:
+            # Shows which have waited longest since their last turn go first
+            turn = turns.get(show_name, -1)
+        return (-self.get_priority(show_name), turn, sequence)
+
+    def _next_show(self, shows: Dict[str, list], turns: Dict[str, int]) -> str:
+        return min(
+            (show_name for show_name, heap in shows.items() if heap),
+            key=lambda show_name: self._show_order(show_name, shows[show_name], turns)
+        )
+
+    def get(self, block: bool = True, timeout: Optional[float] = None):
+        """
+        Returns: next task to download
+
+        Raises: queue.Empty if no task is available within timeout
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.size > 0, timeout=timeout if block else 0):
+                raise queue.Empty
+
+            show_name = self._next_show(self.shows, self.turns)
+            heap = self.shows[show_name]
+            _episode_nr, sequence, task = heapq.heappop(heap)
+            if not heap:
+                del self.shows[show_name]
+            self.turns[show_name] = sequence
+            self.size -= 1
+            return task
+
+    def take(self, predicate, limit: int) -> List[object]:
+        """
+        Removes up to limit tasks matching predicate, oldest episodes first
+
+        Returns: removed tasks
+        """
+        with self.condition:
+            matching = sorted(
+                (entry[:2], show_name, entry)
+                for show_name, heap in self.shows.items()
+                for entry in heap if predicate(entry[2])
+            )[:limit]
+
+            for _key, show_name, entry in matching:
+                heap = self.shows[show_name]
+                heap.remove(entry)
+                if heap:
+                    heapq.heapify(heap)
+                else:
+                    del self.shows[show_name]
+                self.size -= 1
+            return [entry[2] for _key, _show_name, entry in matching]
+
+    def qsize(self) -> int:
+        return self.size
+
+    def ordered(self) -> List[object]:
+        """
+        Returns: awaiting tasks in the order they would be dequeued
+        """
+        with self.condition:
+            shows = {show_name: list(heap) for show_name, heap in self.shows.items()}
+            turns = dict(self.turns)
+
+        tasks = []
+        while any(shows.values()):
+            show_name = self._next_show(shows, turns)
+            _episode_nr, sequence, task = heapq.heappop(shows[show_name])
+            turns[show_name] = sequence
+            tasks.append(task)
+        return tasks
@@ -0,0 +1,87 @@
+"""
+Edit distance functions, kept free of Hexchat imports.
+"""
+
+def levenshtein(s1, s2):
+    """
+    Calculates edit distance between two strings using Levenshtein algorithm
+    https://en.wikibooks.org/wiki/Algorithm_Implementation/Strings/Levenshtein_distance#Python
+    """
+    if len(s1) < len(s2):
+        return levenshtein(s2, s1)
+
+    # len(s1) >= len(s2)
+    if len(s2) == 0:
+        return len(s1)
+
+    previous_row = range(len(s2) + 1)
+    for i, c1 in enumerate(s1):
+        current_row = [i + 1]
+        for j, c2 in enumerate(s2):
+            insertions = previous_row[j + 1] + 1 # j+1 instead of j since previous_row and current_row are one character longer
+            deletions = current_row[j] + 1       # than s2
+            substitutions = previous_row[j] + (c1 != c2)
+            current_row.append(min(insertions, deletions, substitutions))
+        previous_row = current_row
+
+    return previous_row[-1]
+
+def bounded_levenshtein(s1, s2, max_distance):
+    """
+    Calculates edit distance between two strings up to max_distance.
+    Strings differing in length by more than max_distance are rejected without calculation.
+    Common prefix and suffix are skipped, of the rest only a diagonal band of width 2 * max_distance + 1
+    is computed and calculation stops as soon as a whole row exceeds the bound.
+
+    Returns: edit distance or max_distance + 1 if the distance is larger than max_distance
+    """
+    if len(s1) < len(s2):
+        s1, s2 = s2, s1
+
+    exceeded = max_distance + 1
+    # len(s1) >= len(s2)
+    if len(s1) - len(s2) > max_distance:
+        return exceeded
+
+    # Common prefix and suffix do not change the distance
+    start = 0
+    end1, end2 = len(s1), len(s2)
+    while start < end2 and s1[start] == s2[start]:
+        start += 1
+    while end2 > start and s1[end1 - 1] == s2[end2 - 1]:
+        end1 -= 1
+        end2 -= 1
+    s1 = s1[start:end1]
+    s2 = s2[start:end2]
+
+    if len(s2) == 0:
+        return len(s1)
+    if max_distance == 0:
+        return exceeded
+
+    # Both rows are reused, cells outside the band keep values which exceed the bound
+    previous_row = [j if j <= max_distance else exceeded for j in range(len(s2) + 1)]
+    current_row = [exceeded] * (len(s2) + 1)
+    for i, c1 in enumerate(s1, 1):
+        low = max(1, i - max_distance)
+        high = min(len(s2), i + max_distance)
+        current_row[0] = i if i <= max_distance else exceeded
+        current_row[low - 1] = current_row[0] if low == 1 else exceeded
+        row_min = current_row[low - 1]
+        for j in range(low, high + 1):
+            distance = previous_row[j - 1] + (c1 != s2[j - 1])   # substitution
+            if previous_row[j] < distance:
+                distance = previous_row[j] + 1                   # insertion
+            if current_row[j - 1] < distance:
+                distance = current_row[j - 1] + 1                # deletion
+            if distance > exceeded:
+                distance = exceeded
+            current_row[j] = distance
+            if distance < row_min:
+                row_min = distance
+
+        if row_min > max_distance:
+            return exceeded
+        previous_row, current_row = current_row, previous_row
+
+    return min(previous_row[len(s2)], exceeded)
@@ -0,0 +1,120 @@
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional
+
+import auto_xdcc.config as gconfig
+from auto_xdcc.worker_pool import WorkerPool
+
+
+class FileMover(WorkerPool):
+    """
+    Moves completed downloads in worker threads, so large files do not freeze the client.
+    Files are renamed on the same device and copied in chunks across devices.
+    At most per_device copies write to the same device at once.
+    """
+    def __init__(self, workers: int = 2, per_device: int = 1, chunk_size: int = 8 * 1024**2):
+        super().__init__(workers, 'file_mover')
+        self.per_device = per_device
+        self.chunk_size = chunk_size
+        # Device ID -> semaphore bounding copies to the device
+        self.devices: Dict[int, threading.Semaphore] = {}
+        self.logger = logging.getLogger('file_mover')
+
+    @classmethod
+    def from_config(cls, config: dict):
+        keys = {'workers': 'workers', 'perDevice': 'per_device', 'chunkSize': 'chunk_size'}
+        return cls(**{keys[key]: value for key, value in config.items() if key in keys})
+
+    def device_slot(self, device: int) -> threading.Semaphore:
+        with self.lock:
+            if device not in self.devices:
+                self.devices[device] = threading.Semaphore(self.per_device)
+            return self.devices[device]
+
+    def submit(self, src: str, target_dir: str, on_done: Optional[Callable[[str], None]] = None) -> Future:
+        """
+        Moves src into target_dir in the background, on_done is called with the new path after a successful move.
+
+        Returns: future of the new path, None if the move failed
+        """
+        future = self._submit(self.move, src, target_dir)
+        future.add_done_callback(lambda f: self._finish(f, src, on_done))
+        return future
+
+    def _finish(self, future: Future, src: str, on_done: Optional[Callable[[str], None]]):
+        if future.cancelled():
+            return
+        if future.exception():
+            self.logger.error("Moving %s failed", src, exc_info=future.exception())
+        elif future.result() and on_done:
+            on_done(future.result())
+
+    def move(self, src: str, target_dir: str) -> Optional[str]:
+        printer = gconfig.get().printer
+        filename = os.path.basename(src)
+        dst = os.path.join(target_dir, filename)
+        try:
+            os.makedirs(target_dir, mode=0o755, exist_ok=True)
+            if os.stat(src).st_dev == os.stat(target_dir).st_dev:
+                FileMover._rename(src, dst)
+                self.logger.info("Renamed %s to %s", src, dst)
+                return dst
+
+            with self.device_slot(os.stat(target_dir).st_dev):
+                self._copy(src, dst, printer)
+        except OSError as e:
+            self.logger.error("Could not move %s to %s", src, target_dir, exc_info=e)
+            printer.error("Could not move {} to {}: {}".format(filename, target_dir, e.strerror or e))
+            return None
+        return dst
+
+    @staticmethod
+    def _rename(src: str, dst: str):
+        try:
+            os.replace(src, dst)
+        except PermissionError:
+            # Some filesystems allow linking where renaming is denied
+            os.link(src, dst)
+            os.remove(src)
+
+    def _copy(self, src: str, dst: str, printer):
+        filename = os.path.basename(src)
+        tmp_dst = dst + '.part'
+        total = os.path.getsize(src)
+        copied = 0
+        reported = 0
+        started = time.monotonic()
+        try:
+            with open(src, 'rb') as fsrc, open(tmp_dst, 'wb') as fdst:
+                while not self.stopping.is_set():
+                    chunk = fsrc.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    fdst.write(chunk)
+                    copied += len(chunk)
+                    # Report every quarter of the file
+                    if total and copied * 4 // total > reported:
+                        reported = copied * 4 // total
+                        if reported < 4:
+                            printer.prog("Moving {}... {}%".format(filename, reported * 25))
+                if self.stopping.is_set():
+                    raise InterruptedError(0, 'Interrupted by unload')
+                fdst.flush()
+                os.fsync(fdst.fileno())
+            shutil.copystat(src, tmp_dst)
+            os.replace(tmp_dst, dst)
+        except OSError:
+            try:
+                os.remove(tmp_dst)
+            except OSError:
+                pass
+            raise
+        os.remove(src)
+
+        elapsed = max(time.monotonic() - started, 0.001)
+        self.logger.info("Copied %s to %s in %.1fs", src, dst, elapsed)
+        printer.info("Moved {} ({:.1f} MB/s).".format(filename, copied / 1024**2 / elapsed))
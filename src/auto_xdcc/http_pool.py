@@ -0,0 +1,124 @@
+"""
+Shared keep-alive HTTP sessions per host with retries using exponential backoff.
+"""
+import collections
+import email.utils
+import logging
+import random
+import threading
+import time
+import urllib.parse
+from typing import Optional
+
+import requests
+import requests.adapters
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter, limited by a retry budget per host
+    """
+    retry_statuses = frozenset([429, 502, 503, 504])
+
+    def __init__(self, retries: int = 3, backoff_base: float = 1.0, backoff_max: float = 60.0,
+                    budget: int = 10, budget_window: float = 600.0, retry_after_max: float = 300.0):
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.budget = budget
+        self.budget_window = budget_window
+        self.retry_after_max = retry_after_max
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+    def retry_after(self, r: requests.Response) -> Optional[float]:
+        value = r.headers.get('Retry-After')
+        if not value:
+            return None
+
+        if value.strip().isdigit():
+            delay = float(value)
+        else:
+            try:
+                delay = email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+            except (TypeError, ValueError):
+                return None
+        return min(max(delay, 0.0), self.retry_after_max)
+
+
+class HostSession:
+    def __init__(self, host: str, pool_size: int = 4):
+        self.host = host
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.retry_times = collections.deque()
+        self.lock = threading.Lock()
+
+    def take_retry(self, policy: RetryPolicy) -> bool:
+        """
+        Uses one retry from the host's budget.
+
+        Returns: False when the budget is exhausted
+        """
+        now = time.monotonic()
+        with self.lock:
+            while self.retry_times and now - self.retry_times[0] > policy.budget_window:
+                self.retry_times.popleft()
+            if len(self.retry_times) >= policy.budget:
+                return False
+            self.retry_times.append(now)
+            return True
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+default_policy = RetryPolicy()
+
+def get_session(url: str) -> HostSession:
+    host = urllib.parse.urlsplit(url).netloc
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = _sessions[host] = HostSession(host)
+        return session
+
+
+def get(url: str, policy: RetryPolicy = default_policy, **kwargs) -> Optional[requests.Response]:
+    """
+    Sends a GET request through the host's shared session.
+    Timeouts, connection errors and overload responses are retried after a backoff
+    or the delay given in Retry-After, while the host has retry budget left.
+
+    Returns: response or None if the request could not be completed
+    """
+    logger = logging.getLogger('http_pool')
+    host_session = get_session(url)
+    attempt = 0
+    while True:
+        delay = None
+        try:
+            r = host_session.session.get(url, **kwargs)
+            if r.status_code not in policy.retry_statuses:
+                return r
+            delay = policy.retry_after(r)
+            logger.debug('Request to %s returned %d', url, r.status_code)
+        except (requests.Timeout, requests.ConnectionError) as e:
+            r = None
+            logger.debug('Request to %s failed: %s', url, e)
+
+        if attempt >= policy.retries or not host_session.take_retry(policy):
+            if r is not None:
+                return r
+            logger.warning('Giving up request to %s after %d attempts', url, attempt + 1)
+            return None
+
+        if r is not None:
+            r.close()
+        if delay is None:
+            delay = policy.backoff(attempt)
+        attempt += 1
+        logger.debug('Retrying request to %s in %.1fs', url, delay)
+        time.sleep(delay)
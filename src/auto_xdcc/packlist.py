@@ -1,16 +1,70 @@
-import json
+import functools
+import hashlib
 import logging
+import multiprocessing
 import re
+import shutil
+import sys
 import threading
 import requests
 import os
 import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from typing import Optional, Callable, Iterator
 
+import auto_xdcc.http_pool as http_pool
+import auto_xdcc.packlist_parser as packlist_parser
 from auto_xdcc.timer import Timer
 from auto_xdcc.download_manager import DownloadManager
 from auto_xdcc.packlist_item import PacklistItem
+from auto_xdcc.packlist_cache import PacklistCache
+from auto_xdcc.packlist_diff import PacklistSnapshot
+from auto_xdcc.refresh_interval import AdaptiveInterval
+from auto_xdcc.show_index import ShowIndex
 from auto_xdcc.util import get_dcc_completed_dir
+from auto_xdcc.validator_store import ValidatorStore, file_hash
+
+# Returned by requests when the packlist content has not changed
+NOT_MODIFIED = object()
+# Returned by requests when the packlist could not be fetched
+FETCH_FAILED = object()
+
+_parse_pool = None
+_parse_pool_workers = 0
+_parse_pool_lock = threading.Lock()
+
+def find_worker_executable() -> Optional[str]:
+    """
+    Hexchat embeds Python, so workers need the interpreter executable instead of Hexchat's
+
+    Returns: path of a Python interpreter or None if there is none on PATH
+    """
+    if os.path.basename(sys.executable).lower().startswith('python'):
+        return sys.executable
+    return shutil.which('python3') or shutil.which('python')
+
+def get_parse_pool(workers: int) -> ProcessPoolExecutor:
+    global _parse_pool, _parse_pool_workers
+    with _parse_pool_lock:
+        if _parse_pool is None or workers > _parse_pool_workers:
+            if _parse_pool is not None:
+                _parse_pool.shutdown(wait=False)
+
+            context = multiprocessing.get_context('spawn')
+            context.set_executable(find_worker_executable())
+            _parse_pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+            _parse_pool_workers = workers
+        return _parse_pool
+
+def shutdown_parse_pool():
+    global _parse_pool, _parse_pool_workers
+    with _parse_pool_lock:
+        if _parse_pool is not None:
+            _parse_pool.shutdown(wait=False)
+            _parse_pool = None
+            _parse_pool_workers = 0
+
 
 class Packlist:
     class HTTPRequest:
@@ -18,20 +72,15 @@ class Packlist:
             self.filepath = filepath
             self.url = url
             self.query_template = ''
+            self.incremental = False
+            self.chunk_size = 64 * 1024
+            self.validators = ValidatorStore(os.path.splitext(filepath)[0] + '.json')
             self.logger = logging.getLogger('packlist.http_request')
 
-        @staticmethod
-        def retry_connection(request_fn: Callable[[], requests.Request], retries: int) -> Optional[requests.Response]:
-            if retries <= 0:
-                return None
-
-            try:
-                return request_fn()
-            except (requests.Timeout, requests.ConnectionError):
-                return Packlist.HTTPRequest.retry_connection(request_fn, retries - 1)
-
-        def _do_request(self, params: dict, stream: bool = False) -> Optional[requests.Response]:
-            return self.retry_connection(lambda: requests.get(self.url, stream=stream, timeout=10, params=self.compose_query(params)), 3)
+        def _do_request(self, params: dict, stream: bool = False, headers: Optional[dict] = None) -> Optional[requests.Response]:
+            return http_pool.get(
+                self.url, stream=stream, timeout=10, params=self.compose_query(params), headers=headers
+            )
 
         def compose_query(self, params: dict) -> dict:
             if not self.query_template:
@@ -39,51 +88,237 @@ class Packlist:
             query = self.query_template.format_map(params)
             return urllib.parse.parse_qs(query)
 
-        def fetch_content(self, bot_name='', fresh: bool = True) -> iter:
-            if not fresh and os.path.exists(self.filepath):
-                with open(self.filepath) as f:
-                    return f.readlines()
-            r = self._do_request({'bot_name': bot_name})
+        def _conditional_headers(self) -> dict:
+            headers = {}
+            if not os.path.exists(self.filepath):
+                return headers
+
+            if self.validators.get('etag'):
+                headers['If-None-Match'] = self.validators.get('etag')
+            if self.validators.get('lastModified'):
+                headers['If-Modified-Since'] = self.validators.get('lastModified')
+            return headers
+
+        def _update_validators(self, r: requests.Response, offset: int, sha1: Optional[str] = None):
+            self.validators.update(
+                # Byte offset just past the last complete line
+                offset=offset,
+                etag=r.headers.get('ETag'),
+                lastModified=r.headers.get('Last-Modified'),
+                sha1=sha1
+            )
+
+        def _read_lines(self) -> Iterator[str]:
+            with open(self.filepath) as f:
+                yield from f
+
+        def _fetch_tail(self, bot_name: str, only_new: bool) -> Optional[iter]:
+            """
+            Fetches content appended after the last complete line.
+            The request overlaps the stored content by one byte to verify the newline is still there.
+
+            Returns: lines, NOT_MODIFIED or None if a full fetch is required
+            """
+            offset = self.validators.get('offset')
+            start = offset - 1
+            headers = self._conditional_headers()
+            # No If-Range, any append changes the validators. A rewritten file is caught by the overlap and Content-Range checks.
+            headers['Range'] = 'bytes={}-'.format(start)
+
+            r = self._do_request({'bot_name': bot_name}, stream=True, headers=headers)
+            if r is None:
+                return None
+            elif r.status_code == 304:
+                r.close()
+                return NOT_MODIFIED
+            elif r.status_code == 200:
+                # Range ignored or content replaced, response holds the full content
+                return self._stream_full(r)
+            elif r.status_code != 206:
+                r.close()
+                return None
+
+            content_range = r.headers.get('Content-Range', '')
+            match = re.fullmatch(r'bytes ([0-9]+)-[0-9]+/(?:[0-9]+|\*)', content_range.strip())
+            if not match or int(match.group(1)) != start:
+                r.close()
+                return None
+
+            try:
+                content = r.content
+            except requests.RequestException as e:
+                self.logger.error('Fetching %s failed', self.url, exc_info=e)
+                return FETCH_FAILED
+
+            if not content.startswith(b'\n'):
+                return None
+
+            tail = content[1:]
+            if not tail:
+                return NOT_MODIFIED
+
+            self.logger.debug('Appending %d bytes to %s from %s', len(tail), self.filepath, self.url)
+            with open(self.filepath, 'r+b') as f:
+                f.seek(offset)
+                f.truncate()
+                f.write(tail)
+
+            self._update_validators(r, offset + tail.rfind(b'\n') + 1)
+            if not only_new:
+                return self._read_lines()
+
+            # An incomplete last line is parsed on the next fetch when it has been completed
+            complete = tail[:tail.rfind(b'\n') + 1]
+            return complete.decode(r.encoding or 'utf-8', errors='replace').splitlines()
+
+        def _fetch_full(self, bot_name: str) -> iter:
+            r = self._do_request({'bot_name': bot_name}, stream=True, headers=self._conditional_headers())
+
+            if r is not None and r.status_code == 304:
+                r.close()
+                return NOT_MODIFIED
 
             if not r:
-                return iter([])
+                if r is not None:
+                    r.close()
+                return FETCH_FAILED
+
+            return self._stream_full(r)
+
+        def _stream_full(self, r: requests.Response) -> iter:
+            """
+            Writes the response to a temporary file in chunks, hashing it on the way.
+            The packlist file is replaced only after the whole response has been received,
+            and its lines are read only if the content differs from the last fetch.
+
+            Returns: lines of the packlist, NOT_MODIFIED or FETCH_FAILED
+            """
+            tmp_path = self.filepath + '.part'
+            sha1 = hashlib.sha1()
+            size = 0
+            offset = 0
+            try:
+                with r, open(tmp_path, 'wb') as f:
+                    for chunk in r.iter_content(chunk_size=self.chunk_size):
+                        f.write(chunk)
+                        sha1.update(chunk)
+                        newline = chunk.rfind(b'\n')
+                        if newline >= 0:
+                            offset = size + newline + 1
+                        size += len(chunk)
+
+                changed = sha1.hexdigest() != self.validators.get('sha1') or not os.path.exists(self.filepath)
+                if changed:
+                    self.logger.debug('Updating %s with content from %s', self.filepath, self.url)
+                    os.replace(tmp_path, self.filepath)
+                self._update_validators(r, offset, sha1=sha1.hexdigest())
+            except requests.RequestException as e:
+                self.logger.error('Fetching %s failed', self.url, exc_info=e)
+                return FETCH_FAILED
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+            if not changed:
+                # Servers without ETag or Last-Modified send the whole content, the hash still skips the check
+                return NOT_MODIFIED
+            return self._read_lines()
+
+        def fetch_content(self, bot_name='', fresh: bool = True, only_new: bool = False) -> Optional[iter]:
+            """
+            Returns: lines of the packlist, None when the packlist has not changed since the last fetch
+            or FETCH_FAILED
+            """
+            if not fresh and os.path.exists(self.filepath):
+                return self._read_lines()
 
-            self.logger.debug('Updating %s with content from %s', self.filepath, self.url)
-            with open(self.filepath, 'w') as f:
-                f.write(r.text)
+            lines = None
+            offset = self.validators.get('offset', 0)
+            if self.incremental and offset > 0 and os.path.exists(self.filepath) \
+                    and os.path.getsize(self.filepath) >= offset:
+                lines = self._fetch_tail(bot_name, only_new)
+                if lines is None:
+                    self.logger.debug('Range request for %s not honored, fetching full content', self.url)
 
-            return r.iter_lines(decode_unicode=True)
+            if lines is None:
+                lines = self._fetch_full(bot_name)
+
+            if lines is NOT_MODIFIED:
+                self.logger.debug('Packlist %s has not changed', self.url)
+                return None
+            return lines
 
     class BotRequest:
         def __init__(self, filepath: str, packlist_name: str, download_manager: DownloadManager):
             self.filepath = filepath
             self.packlist_name = packlist_name
             self.download_manager = download_manager
+            self.validators = ValidatorStore(os.path.splitext(filepath)[0] + '.json')
+            self.pending_task = None
+            self.received_task = None
+            self.timeout_timer = Timer(120 * 1000, self._expire)
+            self.lock = threading.Lock()
             self.logger = logging.getLogger('packlist.bot_request')
 
-        def _do_request(self, bot_name: str):
-            self.logger.debug('Requesting packlist from %s for %s', bot_name, self.packlist_name)
-            task = self.download_manager.request_list(bot_name, self.packlist_name)
-            # Wait for download task completion
-            task.completion_event.wait(120)
-            return task
-
-        def fetch_content(self, bot_name='', fresh: bool = True):
+        def _expire(self, _userdata):
+            task = self.pending_task
+            if task and self.download_manager.expire_task(task):
+                self.logger.error('Packlist %s was not received in time from %s', self.packlist_name, task.bot_name)
+
+        def request(self, bot_name: str, on_received: Callable[[], None]) -> bool:
+            """
+            Requests the packlist from the bot without waiting for it.
+            on_received is called when the transfer completes, fails or times out,
+            after which fetch_content returns the received packlist.
+
+            Returns: False if a request is already pending
+            """
+            def on_done(task):
+                with self.lock:
+                    self.timeout_timer.unregister()
+                    self.pending_task = None
+                    self.received_task = task
+                on_received()
+
+            with self.lock:
+                if self.pending_task is not None:
+                    return False
+                self.logger.debug('Requesting packlist from %s for %s', bot_name, self.packlist_name)
+                self.pending_task = self.download_manager.request_list(bot_name, self.packlist_name, on_done=on_done)
+                self.timeout_timer.register_once()
+            return True
+
+        def fetch_content(self, bot_name='', fresh: bool = True, only_new: bool = False) -> Optional[list]:
+            """
+            Returns: lines of the packlist, None when no new packlist has been received since the last fetch
+            or FETCH_FAILED
+            """
             if not fresh and os.path.exists(self.filepath):
                 self.logger.debug('Returning existing content from %s', self.filepath)
                 with open(self.filepath) as f:
                     return f.readlines()
-            task = self._do_request(bot_name)
 
-            if not (task and task.is_complete()):
+            with self.lock:
+                task, self.received_task = self.received_task, None
+            if task is None:
+                return None if os.path.exists(self.filepath) else FETCH_FAILED
+
+            if not task.is_complete():
                 self.logger.error('Failed to fetch packlist %s', self.packlist_name)
-                return []
+                return FETCH_FAILED
+
+            sha1 = file_hash(task.get_filepath())
+            if sha1 == self.validators.get('sha1') and os.path.exists(self.filepath):
+                self.logger.debug('Packlist %s has not changed', self.packlist_name)
+                os.remove(task.get_filepath())
+                return None
 
             with open(task.get_filepath()) as f:
                 lines = f.readlines()
 
             self.logger.debug('Updating %s with %s', self.filepath, task.get_filepath())
             os.replace(task.get_filepath(), self.filepath)
+            self.validators.update(sha1=sha1)
             return lines
 
     def __init__(self, name: str, current: str, trusted: list,
@@ -93,9 +328,20 @@ class Packlist:
         self.concurrent_downloads = concurrent_downloads
         self.current = current
         self.trusted = trusted
+        # Bots serving the same packs with the same pack numbers as current
+        self.mirrors = []
         self.refresh_timer = None
+        self.on_refresh = None
+        self.adaptive_interval: Optional[AdaptiveInterval] = None
+        self.refresh_lock = threading.Lock()
+        self.filtered_lines = 0
+        # (line count threshold, worker count) when parsing in worker processes
+        self.parallel_parse = None
         self.download_manager = self.create_manager()
         self.url = None
+        self.cache = PacklistCache(os.path.splitext(self.get_packlist_filepath())[0] + '.cache')
+        self.search_index = ShowIndex()
+        self.snapshot = PacklistSnapshot()
         self.request = Packlist.BotRequest(self.get_packlist_filepath(), self.name, self.download_manager)
 
     @classmethod
@@ -105,8 +351,13 @@ class Packlist:
             refresh_interval=config['refreshInterval'], concurrent_downloads=config['maxConcurrentDownloads']
         )
 
+        new_pl.mirrors = config.get('mirrors', [])
         if config.get('url'):
             new_pl.init_request_params(config['url'])
+        if config.get('parallelParse'):
+            new_pl.set_parallel_parse(**config['parallelParse'])
+        if config.get('adaptiveRefresh'):
+            new_pl.set_adaptive_refresh(config['adaptiveRefresh']['minInterval'], config['adaptiveRefresh']['maxInterval'])
         return new_pl
 
     def __str__(self) -> str:
@@ -123,7 +374,13 @@ class Packlist:
         self.request = Packlist.HTTPRequest(self.get_packlist_filepath(), self.url)
 
     def create_manager(self) -> DownloadManager:
-        return DownloadManager(self.concurrent_downloads, self.trusted)
+        return DownloadManager(self.concurrent_downloads, self.trusted, name=self.name)
+
+    def line_converter(self) -> Callable[[str], Optional[PacklistItem]]:
+        """
+        Returns: picklable function converting a line, used by worker processes
+        """
+        raise NotImplementedError('Must be implemented in subclass')
 
     def convert_line(self, line: str) -> Optional[PacklistItem]:
         raise NotImplementedError('Must be implemented in subclass')
@@ -131,123 +388,209 @@ class Packlist:
     def __iter__(self) -> Iterator[PacklistItem]:
         return self.get_items()
 
-    def get_items(self, fresh: bool = True) -> Iterator[PacklistItem]:
-        lines = self.request.fetch_content(bot_name=self.current, fresh=fresh)
+    def _convert_lines(self, lines: iter, line_filter: Optional[Callable[[str], bool]] = None) -> Iterator[PacklistItem]:
+        self.filtered_lines = 0
         for line in lines:
             if line:
+                if line_filter and not line_filter(line):
+                    self.filtered_lines += 1
+                    continue
                 item = self.convert_line(line.strip())
                 if item:
                     yield item
 
+    def fetch_items(self, only_new: bool = False, line_filter: Optional[Callable[[str], bool]] = None) -> Optional[Iterator[PacklistItem]]:
+        """
+        Fetches the packlist. Lines rejected by line_filter are not parsed.
+
+        Returns: iterator of packlist items, None when the packlist has not changed since the last fetch
+        or FETCH_FAILED
+        """
+        lines = self.request.fetch_content(bot_name=self.current, only_new=only_new)
+        if lines is None or lines is FETCH_FAILED:
+            return lines
+
+        if self.parallel_parse and not (only_new and self.is_incremental()):
+            # Requests store the whole packlist before returning its lines, so it can be split
+            return self.parse_file(line_filter)
+        return self._convert_lines(lines, line_filter)
+
+    def get_items(self, fresh: bool = True, only_new: bool = False,
+                    line_filter: Optional[Callable[[str], bool]] = None) -> Iterator[PacklistItem]:
+        if fresh:
+            lines = self.request.fetch_content(bot_name=self.current, only_new=only_new)
+            if lines is not None and lines is not FETCH_FAILED:
+                return self._convert_lines(lines, line_filter)
+        # Existing content requested, it has not changed or it could not be fetched
+        return self.get_cached_items()
+
+    def get_cached_items(self) -> Iterator[PacklistItem]:
+        """
+        Returns items of the stored packlist, parsing it only when the cache is missing or stale
+        """
+        self.filtered_lines = 0
+        filepath = self.get_packlist_filepath()
+        items = self.cache.load(filepath)
+        if items is None:
+            items = iter(self.cache.store(filepath, self.parse_file()))
+        return items
+
+    def parse_file(self, line_filter: Optional[Callable[[str], bool]] = None) -> Iterator[PacklistItem]:
+        """
+        Parses the stored packlist, in worker processes if parallel parsing is enabled and the packlist is long enough
+        """
+        filepath = self.get_packlist_filepath()
+        if self.parallel_parse and os.path.exists(filepath):
+            threshold, workers = self.parallel_parse
+            if packlist_parser.count_lines(filepath) >= threshold:
+                return self._parse_parallel(filepath, workers, line_filter)
+
+        return self._convert_lines(self._stored_lines(), line_filter)
+
+    def _stored_lines(self) -> iter:
+        lines = self.request.fetch_content(bot_name=self.current, fresh=False)
+        return [] if lines is None or lines is FETCH_FAILED else lines
+
+    def _parse_parallel(self, filepath: str, workers: int, line_filter: Optional[Callable[[str], bool]]) -> Iterator[PacklistItem]:
+        logger = logging.getLogger('packlist')
+        logger.debug('Parsing %s in %d processes', filepath, workers)
+        try:
+            pool = get_parse_pool(workers)
+            futures = [
+                pool.submit(packlist_parser.parse_range, filepath, start, end, self.line_converter(), line_filter)
+                for start, end in packlist_parser.split_line_ranges(filepath, workers)
+            ]
+            # Ranges are in file order, so items stay in pack order
+            results = [future.result() for future in futures]
+        except (OSError, BrokenProcessPool) as e:
+            logger.error('Parallel parsing of %s failed, parsing in process', filepath, exc_info=e)
+            yield from self._convert_lines(self._stored_lines(), line_filter)
+            return
+
+        self.filtered_lines = 0
+        new_item = tuple.__new__
+        for items, filtered in results:
+            self.filtered_lines += filtered
+            for fields in items:
+                yield new_item(PacklistItem, fields)
+
     def register_refresh_timer(self, on_refresh: Callable[[object], bool]):
-        self.refresh_timer = Timer(self.refresh_interval*1000, on_refresh)
+        self.on_refresh = on_refresh
+        self.refresh_timer = Timer(self.get_refresh_interval()*1000, self._refresh_tick)
         self.refresh_timer.register(self)
 
+    def _refresh_tick(self, userdata):
+        self.on_refresh(self)
+        # Checks run in the background, so an adapted interval applies from the next tick
+        interval = self.get_refresh_interval()*1000
+        if interval != self.refresh_timer.interval:
+            self.refresh_timer.reschedule(interval, userdata)
+            return False
+        return True
+
     def run_once(self, time=1):
         assert self.refresh_timer is not None
-        self.refresh_timer.callback(self)
+        self.on_refresh(self)
+
+    def get_refresh_interval(self) -> int:
+        if self.adaptive_interval:
+            return self.adaptive_interval.interval
+        return self.refresh_interval
+
+    def set_refresh_interval(self, interval: int):
+        self.refresh_interval = interval
+        if self.adaptive_interval:
+            self.adaptive_interval.interval = self.adaptive_interval.clamp(interval)
+
+    def set_adaptive_refresh(self, min_interval: int, max_interval: int):
+        self.adaptive_interval = AdaptiveInterval(self.refresh_interval, min_interval, max_interval)
+
+    def record_refresh(self, changed: bool):
+        if self.adaptive_interval:
+            interval = self.adaptive_interval.record(changed)
+            logging.getLogger('packlist').debug('Refresh interval of %s is %ds', self.name, interval)
 
     def set_query_template(self, qstring: str):
         if type(self.request) == Packlist.HTTPRequest:
             self.request.query_template = qstring
 
-    def search(self, search_str: str, callback):
-        def run_thread():
-            matching = {}
-            for item in self.get_items(fresh=False):
-                show_name = item.show_name.lower()
-                if search_str.lower() in show_name:
-                    match = matching.setdefault(show_name, [])
-                    match.append(item)
-
-            callback(matching)
-        t = threading.Thread(target=run_thread)
-        t.start()
+    def set_incremental(self, incremental: bool):
+        if type(self.request) == Packlist.HTTPRequest:
+            self.request.incremental = incremental
 
+    def is_incremental(self) -> bool:
+        return type(self.request) == Packlist.HTTPRequest and self.request.incremental
 
-filename_pattern = r"""
-(   \[.+\]\          # Start of filename, fansub group name
-    (.+)\ -\         # show name, delimiter
-    ([0-9]{2,4}) \s* # Episode nr
-    (?: \[?(v[0-9])\] ?)? \s* # Optional version of episode
-    (\(.+\)|\[.+\])  # Tags delimited by round or square brackets
-    .*\.[a-z]+       # Other optional text, filename extension
-)
-"""
+    def is_requested_from_bot(self) -> bool:
+        return type(self.request) == Packlist.BotRequest
 
-def process_tags(tags):
-    if tags.startswith('('):
-        tags_list = tags.strip('()').split(')(')
-    else:
-        tags_list = tags.strip('[]').split('][')
+    def set_parallel_parse(self, threshold: int = 100000, workers: int = 4):
+        if find_worker_executable() is None:
+            logging.getLogger('packlist').warning('No Python interpreter found on PATH, parsing %s in process', self.name)
+            return
+        self.parallel_parse = (threshold, workers)
 
-    resolution = None
-    for tag in tags_list:
-        match = re.fullmatch(r'^[0-9]{3,4}p$', tag)
-        if match and not resolution:
-            resolution = int(match.group(0).strip('p'))
+    def update_search_index(self) -> ShowIndex:
+        """
+        Updates the search index if the packlist has changed since it was indexed.
+        Called at search time, so refreshes do not parse the whole packlist for searches which may never come.
+        """
+        filepath = self.get_packlist_filepath()
+        key = PacklistCache.source_key(filepath)
+        if key is None or key != self.search_index.source_key:
+            items = self.get_cached_items()
+            self.search_index.update(items, PacklistCache.source_key(filepath))
+        return self.search_index
+
+    def search(self, search_str: str, callback, prefix: bool = False):
+        def run_thread():
+            callback(self.update_search_index().search(search_str, prefix=prefix))
+        t = threading.Thread(target=run_thread)
+        t.start()
 
-    return [resolution]
 
 class TextPacklist(Packlist):
-    pack_format = re.compile(
-        r"""^\#([0-9]+) \s+  # Start of line, packnumber
-        [0-9]+x\             # download count
-        \[([ \.0-9]{3}[MG])\]\ # filesize
-        """
-        + filename_pattern
-        + r"""$              # End of filename, end of line
-        """, re.VERBOSE)
-
-    def convert_line(self, line: str) -> Optional[PacklistItem]:
-        if line.startswith("#"):
-            match = self.pack_format.fullmatch(line)
-            if match:
-                packnumber, size, filename, show_name, episode_nr, version, tags = match.groups()
-                if version:
-                    version = int(version.strip('v'))
+    pack_format = packlist_parser.pack_format
 
-                [resolution] = process_tags(tags)
-                if resolution is None:
-                    return None
+    def line_converter(self) -> Callable[[str], Optional[PacklistItem]]:
+        return packlist_parser.convert_text_line
 
-                return PacklistItem(int(packnumber), size.strip(), filename, show_name, int(episode_nr), version, resolution)
-        return None
+    def convert_line(self, line: str) -> Optional[PacklistItem]:
+        return packlist_parser.convert_text_line(line)
 
 
 class JSPacklist(Packlist):
-    line_format = re.compile(r"(\{.*\})")
-    file_format = re.compile(r"^" + filename_pattern + r"$", re.VERBOSE)
-    unquoted_keys = re.compile(r'([^\{\}])\s*:')
-    quote_keys = r'"\1":'
+    file_format = packlist_parser.file_format
 
     required_keys = set(['bot_name', 'packnumber', 'size', 'filename'])
+    block_size = 1000
 
     def set_json_keys(self, **keys):
         if set(keys) < self.required_keys:
             raise RuntimeError("Missing required keys {}".format(', '.join(self.required_keys)))
         self.keys = keys
 
+    def line_converter(self) -> Callable[[str], Optional[PacklistItem]]:
+        return functools.partial(packlist_parser.convert_js_line, keys=self.keys)
+
     def convert_line(self, line: str) -> Optional[PacklistItem]:
-        stripped_line = re.search(self.line_format, line)
-        if stripped_line:
-            json_line = self.unquoted_keys.sub(self.quote_keys, stripped_line.group(0))
-            j = json.loads(json_line)
-            match = self.file_format.fullmatch(j.get(self.keys['filename']))
-            if match:
-                filename, show_name, episode_nr, version, tags = match.groups()
-                if version:
-                    version = int(version.strip('v'))
-
-                [resolution] = process_tags(tags)
-                if resolution is None:
-                    return None
-
-                return PacklistItem(
-                    int(j.get(self.keys['packnumber'])), j.get(self.keys['size']),
-                    filename, show_name, int(episode_nr), version, resolution
-                )
-        return None
+        return packlist_parser.convert_js_line(line, self.keys)
+
+    def _convert_lines(self, lines: iter, line_filter: Optional[Callable[[str], bool]] = None) -> Iterator[PacklistItem]:
+        # Tokenize blocks of lines in one pass instead of line by line
+        self.filtered_lines = 0
+        block = []
+        for line in lines:
+            if line:
+                if line_filter and not line_filter(line):
+                    self.filtered_lines += 1
+                    continue
+                block.append(line)
+                if len(block) >= self.block_size:
+                    yield from packlist_parser.convert_js_text('\n'.join(block), self.keys)
+                    block = []
+        if block:
+            yield from packlist_parser.convert_js_text('\n'.join(block), self.keys)
 
 
 def create_packlist(name: str, config: dict) -> Packlist:
@@ -265,5 +608,7 @@ def create_packlist(name: str, config: dict) -> Packlist:
     for t in meta_type:
         if t.startswith('query:'):
             packlist.set_query_template(t.replace('query:', '', 1))
+        elif t == 'incremental':
+            packlist.set_incremental(True)
 
     return packlist
@@ -0,0 +1,119 @@
+import mmap
+import os
+import struct
+from typing import Iterable, Iterator, Optional, List
+
+from auto_xdcc.packlist_item import PacklistItem
+
+
+class PacklistCache:
+    """
+    Binary cache of parsed packlist items, keyed on modification time and size of the packlist file.
+
+    Layout: header, fixed size records and UTF-8 string data referenced by the records.
+    The file is memory-mapped on load and items are created while iterating.
+    """
+    magic = b'AXPC'
+    version = 1
+    # magic, version, packlist mtime in ns, packlist size, record count
+    header = struct.Struct('<4sHqqI')
+    # packnumber, episode nr, version (-1 for none), resolution, (offset, length) of size, filename and show name
+    record = struct.Struct('<IIhHIHIHIH')
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @staticmethod
+    def source_key(source_path: str) -> Optional[tuple]:
+        try:
+            stat = os.stat(source_path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def load(self, source_path: str) -> Optional[Iterator[PacklistItem]]:
+        """
+        Returns: iterator of cached items or None if the cache is missing or stale
+        """
+        key = PacklistCache.source_key(source_path)
+        if key is None:
+            return None
+
+        try:
+            with open(self.path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+        if len(mm) < self.header.size:
+            mm.close()
+            return None
+
+        magic, version, mtime_ns, size, count = self.header.unpack_from(mm)
+        if magic != self.magic or version != self.version or (mtime_ns, size) != key:
+            mm.close()
+            return None
+
+        return self._iter_items(mm, count)
+
+    def _iter_items(self, mm: mmap.mmap, count: int) -> Iterator[PacklistItem]:
+        records_end = self.header.size + count * self.record.size
+        try:
+            records = mm[self.header.size:records_end]
+            strings = str(mm[records_end:], 'utf-8')
+        finally:
+            mm.close()
+
+        # Skip PacklistItem.__new__ for speed, the values are already in field order
+        new_item = tuple.__new__
+        for packnumber, episode_nr, version, resolution, size_off, size_len, \
+                filename_off, filename_len, show_off, show_len in self.record.iter_unpack(records):
+            yield new_item(PacklistItem, (
+                packnumber,
+                strings[size_off:size_off + size_len],
+                strings[filename_off:filename_off + filename_len],
+                strings[show_off:show_off + show_len],
+                episode_nr, None if version < 0 else version, resolution
+            ))
+
+    def store(self, source_path: str, items: Iterable[PacklistItem]) -> List[PacklistItem]:
+        """
+        Writes items parsed from the packlist at source_path into the cache.
+        The packlist is checked before consuming items, so a packlist changed meanwhile makes the cache stale.
+
+        Returns: list of the stored items
+        """
+        key = PacklistCache.source_key(source_path)
+        stored = []
+        records = bytearray()
+        strings = []
+        # Repeated strings (show names, sizes) are stored once, offsets and lengths are in characters
+        string_refs = {}
+        strings_len = 0
+
+        def add_string(value: str) -> tuple:
+            nonlocal strings_len
+            ref = string_refs.get(value)
+            if ref is None:
+                ref = string_refs[value] = (strings_len, len(value))
+                strings.append(value)
+                strings_len += len(value)
+            return ref
+
+        for item in items:
+            stored.append(item)
+            records.extend(self.record.pack(
+                item.packnumber, item.episode_nr, -1 if item.version is None else item.version, item.resolution,
+                *add_string(item.size), *add_string(item.filename), *add_string(item.show_name)
+            ))
+
+        if key is None:
+            return stored
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(self.header.pack(self.magic, self.version, key[0], key[1], len(stored)))
+            f.write(records)
+            f.write(''.join(strings).encode('utf-8'))
+        os.replace(tmp_path, self.path)
+        return stored
@@ -0,0 +1,55 @@
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+from auto_xdcc.packlist_item import PacklistItem
+
+
+class PacklistDiff(NamedTuple):
+    added: List[PacklistItem]
+    renumbered: List[PacklistItem]
+    # (packnumber, filename) pairs no longer in the packlist
+    removed: List[Tuple[int, str]]
+
+    def changed_items(self) -> List[PacklistItem]:
+        return self.added + self.renumbered
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.renumbered or self.removed)
+
+
+class PacklistSnapshot:
+    """
+    Pack number to filename mapping of a packlist from its last refresh
+    """
+    def __init__(self):
+        self.packs: Dict[int, str] = {}
+        self.filenames: Dict[str, int] = {}
+        self.initialized = False
+
+    def update(self, items: Iterable[PacklistItem], partial: bool = False) -> PacklistDiff:
+        """
+        Replaces the snapshot with items and compares it to the previous one.
+        A partial update only holds appended packs, so packs missing from it are not removed.
+
+        Returns: diff of added, renumbered and removed packs
+        """
+        packs = dict(self.packs) if partial else {}
+        added = []
+        renumbered = []
+        for item in items:
+            previous_packnumber = self.filenames.get(item.filename)
+            if previous_packnumber is None:
+                added.append(item)
+            elif previous_packnumber != item.packnumber:
+                renumbered.append(item)
+            packs[item.packnumber] = item.filename
+
+        filenames = {filename: packnumber for packnumber, filename in packs.items()}
+        removed = [
+            (packnumber, filename) for filename, packnumber in self.filenames.items()
+            if filename not in filenames
+        ]
+
+        self.packs = packs
+        self.filenames = filenames
+        self.initialized = True
+        return PacklistDiff(added, renumbered, removed)
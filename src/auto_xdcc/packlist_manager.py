@@ -1,74 +1,323 @@
+import functools
 import logging
+import os
 import threading
-from typing import Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 
 import auto_xdcc.config as gconfig
+import auto_xdcc.slot_budget as slot_budget
+import auto_xdcc.disk_space as disk_space
 from auto_xdcc.packlist_item import PacklistItem
-from auto_xdcc.util import is_modified_filename
-from auto_xdcc.packlist import Packlist, create_packlist
+from auto_xdcc.util import get_dcc_completed_dir, is_modified_filename, normalize_filename
+from auto_xdcc.queue_journal import QueueJournal, COMPLETED
+from auto_xdcc.packlist import FETCH_FAILED, Packlist, create_packlist
+from auto_xdcc.show_filter import ShowFilter
 
 
 class PacklistManager:
     def __init__(self):
         self.packlists: Dict[str, Packlist] = {}
         self.queued_downloads: Dict[str, Packlist] = {}
-        self.refresh_lock = threading.Lock()
+        # Normalized filename -> filename of queued download
+        self.queued_index: Dict[str, str] = {}
+        self.matched_shows: Dict[str, dict] = {}
+        self.show_filter = ShowFilter([])
+        self.refresh_pool: Optional[ThreadPoolExecutor] = None
+        # Guards creation of the refresh pool and the show filter
+        self.lock = threading.Lock()
+        self.queued_lock = threading.Lock()
         self.search_cache = []
 
     def register_packlists(self):
         config = gconfig.get()
+        priorities = config.setdefault('priorities', {})
+        slots = config.get('slots', {})
+        slot_budget.get().configure(slots.get('total'), slots.get('perBot'), slots.get('bots'))
+        batch = config.get('batch', {})
+        disk_space.get().configure(config.get('diskSpace', {}).get('margin', 256 * 1024**2))
         for key in config['packlists']:
             packlist = create_packlist(key, config['packlists'][key])
+            packlist.download_manager.awaiting.configure(priorities, config.get('smallestFirst', False))
+            packlist.download_manager.router = functools.partial(self.get_pack_sources, packlist)
+            packlist.download_manager.target_dirs = self.get_target_dirs
+            packlist.download_manager.batch_bots = set(batch.get('bots', []))
+            packlist.download_manager.batch_size = batch.get('size', 5)
+            packlist.download_manager.batch_window = batch.get('window', 100)
             self.register_timers(packlist)
             self.packlists[key] = packlist
         return self.packlists
 
-    def _refresh_thread(self, packlist: Packlist):
+    @staticmethod
+    def _matched_state(shows: dict) -> dict:
+        return {name: (episode_nr, resolution) for name, [episode_nr, resolution, _subdir] in shows.items()}
+
+    def _shows_widened(self, packlist: Packlist, current: dict) -> bool:
+        """
+        Checks if packlist items seen in the last completed check could match the shows now.
+        This happens when a show is added, its resolution changes or its episode count is lowered.
+        """
+        previous = self.matched_shows.get(packlist.name)
+        if previous is None:
+            return True
+
+        for name, (episode_nr, resolution) in current.items():
+            if name not in previous:
+                return True
+            prev_episode_nr, prev_resolution = previous[name]
+            if resolution != prev_resolution:
+                return True
+            if prev_episode_nr is not None and (episode_nr is None or episode_nr < prev_episode_nr):
+                return True
+        return False
+
+    def get_show_filter(self, shows: dict) -> ShowFilter:
+        with self.lock:
+            if self.show_filter.show_names != shows.keys():
+                self.show_filter = ShowFilter(shows)
+            return self.show_filter
+
+    def get_refresh_pool(self) -> ThreadPoolExecutor:
+        with self.lock:
+            if self.refresh_pool is None:
+                workers = gconfig.get().get('refreshWorkers', 4)
+                self.refresh_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='refresh')
+            return self.refresh_pool
+
+    def _refresh_thread(self, packlist: Packlist, received: bool = False):
         config = gconfig.get()
         logger = logging.getLogger('refresh_timer')
+        if packlist.is_requested_from_bot() and not received:
+            # Checked in a continuation once the bot has sent the packlist
+            if packlist.request.request(packlist.current, lambda: self.submit_refresh(packlist, received=True)):
+                logger.info("Requested packlist %s from %s", packlist.name, packlist.current)
+            else:
+                logger.info("Packlist %s has already been requested, skipping", packlist.name)
+            return True
+
+        # Packlists are refreshed independently, a tick arriving during a running check is dropped
+        if not packlist.refresh_lock.acquire(blocking=False):
+            logger.info("Packlist check for %s is already running, skipping", packlist.name)
+            return True
+
         logger.info("Starting packlist check for %s", packlist.name)
-        with self.refresh_lock:
-            for item in packlist:
-                if item.show_name in config['shows']:
-                    [episode_nr, resolution, _subdir] = config['shows'][item.show_name]
-                    if item.is_new(episode_nr, resolution) and item.filename not in self.queued_downloads:
-                        packlist.download_manager.queue_download(packlist.current, item)
-                        self.queued_downloads[item.filename] = packlist
-                        logger.info("Queueing download of %s - %02d", item.show_name, item.episode_nr)
-                        config.printer.prog("Queueing download of {} - {:02d}.".format(item.show_name, item.episode_nr))
+        try:
+            matched_state = PacklistManager._matched_state(config['shows'])
+            widened = self._shows_widened(packlist, matched_state)
+            show_filter = self.get_show_filter(config['shows'])
+            items = packlist.fetch_items(only_new=not widened, line_filter=show_filter)
+            # A failed fetch is not an empty packlist, diffing it would remove every pack
+            if items is FETCH_FAILED:
+                logger.error("Fetching packlist %s failed, skipping check", packlist.name)
+                return True
+            if items is None:
+                if not widened:
+                    packlist.record_refresh(False)
+                    logger.info("Packlist %s has not changed, skipping check", packlist.name)
+                    return True
+                items = packlist.get_cached_items()
+
+            watched = [item for item in items if item.show_name in config['shows']]
+            initialized = packlist.snapshot.initialized
+            # Incremental fetches only return appended packs
+            diff = packlist.snapshot.update(watched, partial=not widened and packlist.is_incremental())
+            logger.info(
+                "Packlist %s has %d added, %d renumbered and %d removed packs", packlist.name,
+                len(diff.added), len(diff.renumbered), len(diff.removed)
+            )
+            if widened:
+                # Packs seen earlier may match the changed shows
+                candidates = watched
+            else:
+                candidates = diff.changed_items()
+                if initialized:
+                    for item in diff.added:
+                        config.printer.new_pack("{}: #{} {}".format(packlist.name, item.packnumber, item.filename))
 
+            for item in candidates:
+                [episode_nr, resolution, _subdir] = config['shows'][item.show_name]
+                if item.is_new(episode_nr, resolution) and self.add_queued_download(item.filename, packlist):
+                    packlist.download_manager.queue_download(packlist.current, item)
+                    logger.info("Queueing download of %s - %02d", item.show_name, item.episode_nr)
+                    config.printer.prog("Queueing download of {} - {:02d}.".format(item.show_name, item.episode_nr))
+
+            # Checks ending early leave the shows to be matched by the next one
+            self.matched_shows[packlist.name] = matched_state
             packlist.download_manager.start()
             config.printer.flush()
+            # Download counters change the content on almost every check, so only new pack numbers count as a change
+            packlist.record_refresh(initialized and not widened and bool(diff.changed_items()))
+        finally:
+            packlist.refresh_lock.release()
 
-        logger.info("Ending packlist check for %s", packlist.name)
+        logger.info("Ending packlist check for %s, %d lines filtered out", packlist.name, packlist.filtered_lines)
 
         return True
 
+    def submit_refresh(self, packlist: Packlist, received: bool = False):
+        future = self.get_refresh_pool().submit(self._refresh_thread, packlist, received)
+        future.add_done_callback(self._log_refresh_error)
+
     def refresh_timer_callback(self, packlist: Packlist):
-        t = threading.Thread(target=self._refresh_thread, args=(packlist,))
-        t.start()
+        self.submit_refresh(packlist)
         return True
 
+    @staticmethod
+    def _log_refresh_error(future):
+        if not future.cancelled() and future.exception() is not None:
+            logging.getLogger('refresh_timer').error("Packlist check failed", exc_info=future.exception())
+
+    def add_queued_download(self, filename: str, packlist: Packlist) -> bool:
+        """
+        Returns: False if the file has already been queued
+        """
+        with self.queued_lock:
+            if filename in self.queued_downloads:
+                return False
+            self.queued_downloads[filename] = packlist
+            self.queued_index[normalize_filename(filename)] = filename
+            return True
+
     def get_packlist_by(self, filename: str):
-        if filename in self.queued_downloads:
-            return self.queued_downloads.get(filename)
+        with self.queued_lock:
+            packlist = self.queued_downloads.get(filename)
+            if packlist is None:
+                packlist = self.queued_downloads.get(self.queued_index.get(normalize_filename(filename)))
+            if packlist is not None:
+                return packlist
 
         for packlist in self.packlists.values():
             # Check if download managers have task for this
-            if packlist.download_manager.get_task(filename):
+            if packlist.download_manager.get_task(filename, fuzzy=False):
                 return packlist
 
-        for download in self.queued_downloads.keys():
+        # Rewritten in a way the normalized filename does not cover
+        with self.queued_lock:
+            queued = list(self.queued_downloads.items())
+        for download, packlist in queued:
             if is_modified_filename(download, filename):
-                return self.queued_downloads.get(download)
+                return packlist
+
+        for packlist in self.packlists.values():
+            if packlist.download_manager.get_task(filename):
+                return packlist
 
         return None
 
+    def get_pack_sources(self, packlist: Packlist, item: PacklistItem) -> List[Tuple[str, int]]:
+        """
+        Finds bots offering the item. Other packlists are looked up by filename in the packs of watched shows.
+
+        Returns: (bot name, pack number) pairs, the packlist's own bot and mirrors first
+        """
+        sources = [(bot, item.packnumber) for bot in [packlist.current] + packlist.mirrors]
+        for other in self.packlists.values():
+            if other is packlist:
+                continue
+            packnumber = other.snapshot.filenames.get(item.filename)
+            if packnumber is not None:
+                sources.extend((bot, packnumber) for bot in [other.current] + other.mirrors)
+        return sources
+
+    def get_target_dirs(self, item: PacklistItem) -> List[str]:
+        """
+        Returns: completed downloads directory and the show's subdirectory the item is moved to, if it has one
+        """
+        completed_dir = get_dcc_completed_dir()
+        show = gconfig.get()['shows'].get(item.show_name)
+        if show and show[2]:
+            return [completed_dir, os.path.join(completed_dir, show[2])]
+        return [completed_dir]
+
+    def fuzzy_search(self, search_str: str, limit: int = 10) -> List[Tuple[int, List[PacklistItem]]]:
+        """
+        Ranks show names of all packlists by edit distance to search_str.
+        About a quarter of the search string may differ from the show name.
+
+        Returns: up to limit (distance, items) tuples, closest first
+        """
+        max_distance = max(1, len(search_str) // 4)
+        matching = {}
+        for packlist in self.packlists.values():
+            for distance, name, items in packlist.update_search_index().fuzzy_search(search_str, max_distance):
+                match = matching.setdefault(name, [distance, []])
+                match[1].extend(items)
+
+        ranked = sorted(matching.items(), key=lambda match: (match[1][0], match[0]))
+        return [(distance, items) for _name, [distance, items] in ranked[:limit]]
+
+    @staticmethod
+    def _downloaded_files(directory: str) -> Dict[str, str]:
+        """
+        Returns: paths of files in directory by normalized filename
+        """
+        try:
+            return {normalize_filename(entry.name): entry.path for entry in os.scandir(directory) if entry.is_file()}
+        except OSError:
+            return {}
+
+    def restore_queue(self, journal: QueueJournal):
+        """
+        Queues downloads left unfinished in the journal, except those of shows no longer wanting them
+        and those already found in the DCC directory.
+        Files are considered complete if their size matches the size offered by the bot,
+        downloads which never connected are queued again.
+        Download managers record further changes to the journal.
+        """
+        config = gconfig.get()
+        logger = logging.getLogger('queue_journal')
+        completed_dir = get_dcc_completed_dir()
+        directories = {}
+        restored = 0
+        for packlist in self.packlists.values():
+            packlist.download_manager.journal = journal
+
+        for entry in journal.load():
+            packlist = self.packlists.get(entry['packlist'])
+            item = QueueJournal.item_of(entry)
+            if packlist is None or item.show_name not in config['shows']:
+                journal.record(COMPLETED, entry['packlist'], entry['bot'], item)
+                continue
+
+            [episode_nr, resolution, subdir] = config['shows'][item.show_name]
+            # The show's episode count or resolution may have changed since the download was queued
+            if not item.is_new(episode_nr, resolution):
+                logger.info("%s is no longer wanted, not queueing it again", item.filename)
+                journal.record(COMPLETED, packlist.name, entry['bot'], item)
+                continue
+
+            directory = os.path.join(completed_dir, subdir) if subdir else completed_dir
+            if directory not in directories:
+                directories[directory] = self._downloaded_files(directory)
+            path = directories[directory].get(normalize_filename(item.filename))
+            if path and entry.get('filesize') is not None and os.path.getsize(path) == entry['filesize']:
+                logger.info("Found downloaded %s, not queueing it again", item.filename)
+                journal.record(COMPLETED, packlist.name, entry['bot'], item)
+                if episode_nr is None or item.episode_nr > episode_nr:
+                    config['shows'][item.show_name][0] = item.episode_nr
+                    config.persist()
+                continue
+
+            if self.add_queued_download(item.filename, packlist):
+                packlist.download_manager.queue_download(entry['bot'], item)
+                restored += 1
+
+        for packlist in self.packlists.values():
+            if packlist.download_manager.count_awaiting():
+                packlist.download_manager.start()
+        return restored
+
     def register_timers(self, packlist: Packlist):
         packlist.register_refresh_timer(self.refresh_timer_callback)
 
     def clear_download_queue(self):
-        self.queued_downloads.clear()
+        with self.queued_lock:
+            self.queued_downloads.clear()
+            self.queued_index.clear()
+
+    def terminate(self):
+        if self.refresh_pool is not None:
+            self.refresh_pool.shutdown(wait=False)
 
     def clear_search_cache(self):
         self.search_cache.clear()
@@ -0,0 +1,203 @@
+"""
+Packlist line parsing, kept free of Hexchat imports so it can run in worker processes.
+"""
+import json
+import re
+from typing import Optional, Callable, Iterable, Iterator, List, Tuple
+
+from auto_xdcc.packlist_item import PacklistItem
+
+
+filename_pattern = r"""
+(   \[.+\]\          # Start of filename, fansub group name
+    (.+)\ -\         # show name, delimiter
+    ([0-9]{2,4}) \s* # Episode nr
+    (?: \[?(v[0-9])\] ?)? \s* # Optional version of episode
+    (\(.+\)|\[.+\])  # Tags delimited by round or square brackets
+    .*\.[a-z]+       # Other optional text, filename extension
+)
+"""
+
+crc32_format = re.compile(r"[\[(]([0-9A-Fa-f]{8})[\])]")
+
+def parse_crc32(filename: str) -> Optional[int]:
+    """
+    Returns: CRC32 embedded in a release filename like [Group] Show - 01 [1080p][ABCD1234].mkv
+    """
+    matches = crc32_format.findall(filename)
+    return int(matches[-1], 16) if matches else None
+
+
+def process_tags(tags):
+    if tags.startswith('('):
+        tags_list = tags.strip('()').split(')(')
+    else:
+        tags_list = tags.strip('[]').split('][')
+
+    resolution = None
+    for tag in tags_list:
+        match = re.fullmatch(r'^[0-9]{3,4}p$', tag)
+        if match and not resolution:
+            resolution = int(match.group(0).strip('p'))
+
+    return [resolution]
+
+
+pack_format = re.compile(
+    r"""^\#([0-9]+) \s+  # Start of line, packnumber
+    [0-9]+x\             # download count
+    \[([ \.0-9]{3}[MG])\]\ # filesize
+    """
+    + filename_pattern
+    + r"""$              # End of filename, end of line
+    """, re.VERBOSE)
+
+def convert_text_line(line: str) -> Optional[PacklistItem]:
+    if line.startswith("#"):
+        match = pack_format.fullmatch(line)
+        if match:
+            packnumber, size, filename, show_name, episode_nr, version, tags = match.groups()
+            if version:
+                version = int(version.strip('v'))
+
+            [resolution] = process_tags(tags)
+            if resolution is None:
+                return None
+
+            return PacklistItem(int(packnumber), size.strip(), filename, show_name, int(episode_nr), version, resolution)
+    return None
+
+
+file_format = re.compile(r"^" + filename_pattern + r"$", re.VERBOSE)
+
+js_string = r"""(?:"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')"""
+
+class JSObjectTokenizer:
+    """
+    Single pass tokenizer for packlists made of JS object literals, e.g. {b:"Bot", n:1, s:"100M", f:"file.mkv"}.
+    Keys may be unquoted or quoted. Only pairs with the given keys are extracted,
+    string literals of other pairs are skipped without being decoded.
+    """
+    def __init__(self, keys: Iterable[str]):
+        key_pattern = '|'.join(re.escape(key) for key in sorted(keys, key=len, reverse=True))
+        self.token_format = re.compile(
+            # Pair with an extracted key
+            r"""(?<![\w$])(?:"({0})"|'({0})'|({0}))\s*:\s*({1}|[^,}}\s]+)""".format(key_pattern, js_string)
+            # Any other string literal
+            + r"|" + js_string
+            # End of object
+            + r"|(\})"
+        )
+
+    def objects(self, text: str) -> Iterator[dict]:
+        """
+        Returns: iterator of dictionaries with raw values of extracted keys, one per object
+        """
+        fields = {}
+        for double_quoted, single_quoted, unquoted, value, end in self.token_format.findall(text):
+            if end:
+                if fields:
+                    yield fields
+                    fields = {}
+            elif value:
+                fields[double_quoted or single_quoted or unquoted] = value
+
+def js_value(value: str) -> str:
+    if value[0] == '"' or value[0] == "'":
+        string = value[1:-1]
+        if '\\' not in string:
+            return string
+        if value[0] == "'":
+            string = string.replace("\\'", "'").replace('"', '\\"')
+        return json.loads('"' + string + '"')
+    return value
+
+_js_tokenizers = {}
+
+def get_js_tokenizer(keys: dict) -> JSObjectTokenizer:
+    key_set = frozenset(keys.values())
+    tokenizer = _js_tokenizers.get(key_set)
+    if tokenizer is None:
+        tokenizer = _js_tokenizers[key_set] = JSObjectTokenizer(key_set)
+    return tokenizer
+
+def convert_js_text(text: str, keys: dict) -> Iterator[PacklistItem]:
+    """
+    Converts all objects in text in one pass.
+    """
+    for j in get_js_tokenizer(keys).objects(text):
+        filename = j.get(keys['filename'])
+        packnumber = j.get(keys['packnumber'])
+        if filename is None or packnumber is None:
+            continue
+
+        match = file_format.fullmatch(js_value(filename))
+        if match:
+            filename, show_name, episode_nr, version, tags = match.groups()
+            if version:
+                version = int(version.strip('v'))
+
+            [resolution] = process_tags(tags)
+            if resolution is None:
+                continue
+
+            size = j.get(keys['size'])
+            yield PacklistItem(
+                int(js_value(packnumber)), size and js_value(size),
+                filename, show_name, int(episode_nr), version, resolution
+            )
+
+def convert_js_line(line: str, keys: dict) -> Optional[PacklistItem]:
+    return next(convert_js_text(line, keys), None)
+
+
+def count_lines(filepath: str) -> int:
+    count = 0
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024**2), b''):
+            count += chunk.count(b'\n')
+    return count
+
+def split_line_ranges(filepath: str, parts: int) -> List[Tuple[int, int]]:
+    """
+    Splits a file into byte ranges of roughly equal size, each starting at the beginning of a line.
+    """
+    with open(filepath, 'rb') as f:
+        f.seek(0, 2)
+        size = f.tell()
+        bounds = [0]
+        for i in range(1, parts):
+            position = max(size * i // parts, bounds[-1])
+            f.seek(position)
+            if position > 0:
+                # Move to the start of the next line
+                f.seek(position - 1)
+                f.readline()
+            bounds.append(f.tell())
+        bounds.append(size)
+
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+def parse_range(filepath: str, start: int, end: int, convert: Callable[[str], Optional[PacklistItem]],
+                line_filter: Optional[Callable[[str], bool]] = None) -> Tuple[List[tuple], int]:
+    """
+    Parses lines in the given byte range of a packlist file. Runs in worker processes.
+
+    Returns: tuple of parsed item fields and number of lines rejected by line_filter
+    """
+    with open(filepath, 'rb') as f:
+        f.seek(start)
+        content = f.read(end - start).decode('utf-8', errors='replace')
+
+    items = []
+    filtered = 0
+    for line in content.splitlines():
+        if line:
+            if line_filter and not line_filter(line):
+                filtered += 1
+                continue
+            item = convert(line.strip())
+            if item:
+                # Plain tuples are quicker to transfer between processes
+                items.append(tuple(item))
+    return (items, filtered)
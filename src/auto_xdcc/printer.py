@@ -34,6 +34,10 @@ class AbstractPrinter(ABC):
     def complete(self, line: str):
         pass
 
+    @abstractmethod
+    def new_pack(self, line: str):
+        pass
+
     @abstractmethod
     def flush(self):
         pass
@@ -79,6 +83,10 @@ class Printer(AbstractPrinter):
         for listener in self.listeners:
             self.message_queue.put((listener, listener.complete(str(line))))
 
+    def new_pack(self, line: str):
+        for listener in self.listeners:
+            self.message_queue.put((listener, listener.new_pack(str(line))))
+
     def flush(self):
         while self.message_queue.qsize() > 0:
             try:
@@ -112,6 +120,9 @@ class DirectPrinter(AbstractPrinter):
     def complete(self, line: str):
         self.printer.print_msg(self.printer.complete(line))
 
+    def new_pack(self, line: str):
+        self.printer.print_msg(self.printer.new_pack(line))
+
     def flush(self):
         self.printer.flush()
 
@@ -165,6 +176,9 @@ class HexchatPrinter(AbstractPrinter):
     def complete(self, line):
         return self.format_message([Color.light_green2,Color.light_green2], line)
 
+    def new_pack(self, line):
+        return self.format_message([Color.aqua2,Color.blue_grey2, Color.blue], line, "New pack")
+
     def flush(self):
         # Nothing to do here
         pass
@@ -201,6 +215,9 @@ class TelegramBotPrinter(AbstractPrinter):
     def complete(self, line: str):
         return line
 
+    def new_pack(self, line: str):
+        return 'New pack - ' + line
+
     def flush(self):
         messages = []
         while self.buffer.qsize() > 0:
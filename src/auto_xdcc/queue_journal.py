@@ -0,0 +1,150 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Dict, List, Optional
+
+from auto_xdcc.packlist_item import PacklistItem
+
+QUEUED = 'queued'
+REQUESTED = 'requested'
+CONNECTED = 'connected'
+COMPLETED = 'completed'
+ABORTED = 'aborted'
+
+FINISHED = (COMPLETED, ABORTED)
+
+
+class QueueJournal:
+    """
+    Append-only journal of download task state changes, one JSON object per line.
+    The last entry of each filename tells its state. Entries of finished tasks are dropped
+    when the journal is compacted, which happens after compact_threshold appended entries.
+    Entries are written and synced by a writer thread, in batches of those recorded meanwhile.
+    """
+    def __init__(self, path: str, compact_threshold: int = 500):
+        self.path = path
+        self.compact_threshold = compact_threshold
+        self.appended = 0
+        # Filename -> last entry of unfinished tasks
+        self.live: Dict[str, dict] = {}
+        self.lock = threading.Lock()
+        # Entries waiting for the writer thread, None stops it
+        self.entries: queue.Queue = queue.Queue()
+        self.writer: Optional[threading.Thread] = None
+        self.logger = logging.getLogger('queue_journal')
+
+    def load(self) -> List[dict]:
+        """
+        Replays the journal and compacts it.
+        An incomplete last line, left by a crash while appending, is ignored.
+
+        Returns: last entries of unfinished tasks in the order they were queued
+        """
+        live = {}
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        self.logger.warning('Skipping corrupt entry in %s', self.path)
+                        continue
+                    filename = entry['item'][2]
+                    if entry['event'] in FINISHED:
+                        live.pop(filename, None)
+                    else:
+                        live[filename] = entry
+        except OSError:
+            pass
+
+        with self.lock:
+            self.live = live
+        self._compact(list(live.values()))
+        return list(live.values())
+
+    def record(self, event: str, packlist_name: str, bot_name: str, item: PacklistItem, filesize: Optional[int] = None):
+        """
+        Appends an entry. The exact filesize offered by the bot is kept in later entries of the file.
+        """
+        entry = {'event': event, 'packlist': packlist_name, 'bot': bot_name, 'item': list(item), 'time': int(time.time())}
+        with self.lock:
+            if filesize is None and item.filename in self.live:
+                filesize = self.live[item.filename].get('filesize')
+            if filesize is not None:
+                entry['filesize'] = filesize
+            if event in FINISHED:
+                self.live.pop(item.filename, None)
+            else:
+                self.live[item.filename] = entry
+
+            if self.writer is None:
+                self.writer = threading.Thread(target=self._write_entries, name='queue_journal', daemon=True)
+                self.writer.start()
+        self.entries.put(entry)
+
+    def _write_entries(self):
+        while True:
+            entries = [self.entries.get()]
+            # Sync everything recorded meanwhile at once
+            while True:
+                try:
+                    entries.append(self.entries.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = None in entries
+            entries = [entry for entry in entries if entry is not None]
+            if entries:
+                self._append(entries)
+            if stop:
+                return
+
+    def _append(self, entries: List[dict]):
+        try:
+            with open(self.path, 'a') as f:
+                for entry in entries:
+                    f.write(json.dumps(entry) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError as e:
+            self.logger.error('Could not write to %s', self.path, exc_info=e)
+            return
+
+        self.appended += len(entries)
+        if self.appended >= self.compact_threshold:
+            with self.lock:
+                live = list(self.live.values())
+            self._compact(live)
+
+    def close(self, timeout: float = 5.0):
+        """
+        Writes the remaining entries and stops the writer thread.
+        """
+        with self.lock:
+            writer = self.writer
+            self.writer = None
+        if writer is not None:
+            self.entries.put(None)
+            writer.join(timeout)
+
+    def _compact(self, live: List[dict]):
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                # Entries still waiting for the writer are also live, appending them again is harmless
+                for entry in live:
+                    f.write(json.dumps(entry) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            self.logger.error('Could not compact %s', self.path, exc_info=e)
+            return
+        self.appended = 0
+
+    @staticmethod
+    def item_of(entry: dict) -> PacklistItem:
+        return PacklistItem(*entry['item'])
@@ -0,0 +1,34 @@
+import collections
+import time
+from typing import Optional
+
+
+class AdaptiveInterval:
+    """
+    Refresh interval adapted to how often a packlist changes.
+    The interval is halved on every observed change and doubled after every check without changes,
+    bounded by min_interval and max_interval.
+    """
+    def __init__(self, interval: int, min_interval: int, max_interval: int, history: int = 20):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = self.clamp(interval)
+        # Times of observed changes, most recent last
+        self.changes = collections.deque(maxlen=history)
+
+    def clamp(self, interval: int) -> int:
+        return max(self.min_interval, min(self.max_interval, int(interval)))
+
+    def record(self, changed: bool) -> int:
+        """
+        Returns: interval for the next check in seconds
+        """
+        if changed:
+            self.changes.append(time.time())
+            self.interval = self.clamp(self.interval / 2)
+        else:
+            self.interval = self.clamp(self.interval * 2)
+        return self.interval
+
+    def last_change(self) -> Optional[float]:
+        return self.changes[-1] if self.changes else None
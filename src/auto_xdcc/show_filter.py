@@ -0,0 +1,41 @@
+from typing import Iterable
+
+
+class ShowFilter:
+    """
+    Prefilter for packlist lines, rejects lines which can not contain an item of any of the given shows.
+    Packlist filenames have the show name followed by " - " and the episode number,
+    so each delimiter in the line is checked for a preceding show name.
+    Show names are bucketed by their last characters, keeping the check cost flat as more shows are added.
+    Lines with a backslash are passed, escapes in JS strings can hide a show name from the raw line.
+    """
+    delimiter = ' - '
+    key_length = 3
+
+    def __init__(self, show_names: Iterable[str]):
+        self.show_names = frozenset(show_names)
+        buckets = {}
+        short_names = []
+        for name in self.show_names:
+            if len(name) < self.key_length:
+                short_names.append(name)
+            else:
+                buckets.setdefault(name[-self.key_length:], []).append(name)
+
+        self.buckets = {key: tuple(names) for key, names in buckets.items()}
+        self.short_names = tuple(short_names)
+
+    def __call__(self, line: str) -> bool:
+        if '\\' in line:
+            return True
+        delimiter = self.delimiter
+        key_length = self.key_length
+        idx = line.find(delimiter)
+        while idx >= 0:
+            names = idx >= key_length and self.buckets.get(line[idx - key_length:idx])
+            if names and line.endswith(names, 0, idx):
+                return True
+            if self.short_names and line.endswith(self.short_names, 0, idx):
+                return True
+            idx = line.find(delimiter, idx + 1)
+        return False
@@ -0,0 +1,101 @@
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Set, Tuple
+
+from auto_xdcc.packlist_item import PacklistItem
+from auto_xdcc.edit_distance import bounded_levenshtein
+
+
+class ShowIndex:
+    """
+    Trigram index over distinct show names of a packlist.
+    Substring and prefix queries intersect the posting lists of the query's trigrams
+    and verify only the remaining candidates.
+    """
+    gram_size = 3
+
+    def __init__(self):
+        # Lowercased show name -> items of the show
+        self.shows: Dict[str, List[PacklistItem]] = {}
+        self.postings: Dict[str, Set[str]] = {}
+        self.source_key = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def grams(cls, name: str) -> Set[str]:
+        return {name[i:i + cls.gram_size] for i in range(len(name) - cls.gram_size + 1)}
+
+    def _add_show(self, name: str):
+        for gram in ShowIndex.grams(name):
+            self.postings.setdefault(gram, set()).add(name)
+
+    def _remove_show(self, name: str):
+        for gram in ShowIndex.grams(name):
+            posting = self.postings.get(gram)
+            if posting is not None:
+                posting.discard(name)
+                if not posting:
+                    del self.postings[gram]
+
+    def update(self, items: Iterable[PacklistItem], source_key=None):
+        """
+        Replaces indexed items. Only postings of added or removed show names are changed.
+        """
+        shows = {}
+        for item in items:
+            shows.setdefault(item.show_name.lower(), []).append(item)
+
+        with self.lock:
+            for name in self.shows.keys() - shows.keys():
+                self._remove_show(name)
+            for name in shows.keys() - self.shows.keys():
+                self._add_show(name)
+            self.shows = shows
+            self.source_key = source_key
+
+    def candidates(self, query: str) -> Iterable[str]:
+        grams = ShowIndex.grams(query)
+        if not grams:
+            return self.shows.keys()
+
+        postings = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+        return postings[0].intersection(*postings[1:])
+
+    def search(self, query: str, prefix: bool = False) -> Dict[str, List[PacklistItem]]:
+        """
+        Case insensitive search of show names containing (or starting with, if prefix is set) the query.
+
+        Returns: dictionary of lowercased show names and their items
+        """
+        query = query.lower()
+        with self.lock:
+            if prefix:
+                return {name: list(self.shows[name]) for name in self.candidates(query) if name.startswith(query)}
+            return {name: list(self.shows[name]) for name in self.candidates(query) if query in name}
+
+    def fuzzy_search(self, query: str, max_distance: int) -> List[Tuple[int, str, List[PacklistItem]]]:
+        """
+        Finds show names within max_distance edits of the query.
+        Each edit changes at most gram_size of the query's trigrams, so names sharing
+        fewer trigrams with the query are skipped without computing the distance.
+
+        Returns: list of (distance, lowercased show name, items) tuples
+        """
+        query = query.lower()
+        grams = ShowIndex.grams(query)
+        min_common = len(grams) - max_distance * self.gram_size
+        results = []
+        with self.lock:
+            if min_common > 0:
+                common = Counter()
+                for gram in grams:
+                    common.update(self.postings.get(gram, ()))
+                candidates = [name for name, count in common.items() if count >= min_common]
+            else:
+                candidates = self.shows.keys()
+
+            for name in candidates:
+                distance = bounded_levenshtein(query, name, max_distance)
+                if distance <= max_distance:
+                    results.append((distance, name, list(self.shows[name])))
+        return results
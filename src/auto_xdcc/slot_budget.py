@@ -0,0 +1,108 @@
+import collections
+import itertools
+import threading
+from typing import Dict, Optional
+
+
+class SlotBudget:
+    """
+    Download slots shared by all download managers, limited in total and per bot.
+    When slots are contended, the packlist holding the fewest slots gets the next one,
+    and requests of equally served packlists get them in arrival order.
+    """
+    def __init__(self, total: Optional[int] = None, per_bot: Optional[int] = None, bots: Optional[Dict[str, int]] = None):
+        self.total = total
+        self.per_bot = per_bot
+        self.bots = bots or {}
+        self.bot_usage = collections.Counter()
+        self.packlist_usage = collections.Counter()
+        # Sequence number -> (packlist name, bot name) of waiting requests
+        self.waiting: Dict[int, tuple] = {}
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+
+    def configure(self, total: Optional[int] = None, per_bot: Optional[int] = None, bots: Optional[Dict[str, int]] = None):
+        with self.condition:
+            self.total = total
+            self.per_bot = per_bot
+            self.bots = bots or {}
+            self.condition.notify_all()
+
+    def reset(self):
+        """
+        Forgets all held slots. The budget outlives plugin reloads, which drop the tasks holding them.
+        """
+        with self.condition:
+            self.bot_usage.clear()
+            self.packlist_usage.clear()
+            self.condition.notify_all()
+
+    def bot_limit(self, bot_name: str) -> Optional[int]:
+        return self.bots.get(bot_name, self.per_bot)
+
+    def used(self) -> int:
+        return sum(self.bot_usage.values())
+
+    def _available(self, bot_name: str) -> bool:
+        if self.total and self.used() >= self.total:
+            return False
+        limit = self.bot_limit(bot_name)
+        return not limit or self.bot_usage[bot_name] < limit
+
+    def has_capacity(self, bot_name: str) -> bool:
+        with self.condition:
+            return self._available(bot_name)
+
+    def _is_next(self, sequence: int) -> bool:
+        packlist_name, bot_name = self.waiting[sequence]
+        if not self._available(bot_name):
+            return False
+
+        order = (self.packlist_usage[packlist_name], sequence)
+        return all(
+            order < (self.packlist_usage[other_packlist], other)
+            for other, (other_packlist, other_bot) in self.waiting.items()
+            if other != sequence and self._available(other_bot)
+        )
+
+    def acquire(self, packlist_name: str, bot_name: str, timeout: Optional[float] = None) -> bool:
+        """
+        Returns: False if no slot became available within timeout
+        """
+        with self.condition:
+            sequence = next(self.sequence)
+            self.waiting[sequence] = (packlist_name, bot_name)
+            try:
+                if not self.condition.wait_for(lambda: self._is_next(sequence), timeout=timeout):
+                    return False
+                self.bot_usage[bot_name] += 1
+                self.packlist_usage[packlist_name] += 1
+                return True
+            finally:
+                del self.waiting[sequence]
+                # Others may be next now
+                self.condition.notify_all()
+
+    def release(self, packlist_name: str, bot_name: str):
+        with self.condition:
+            self.bot_usage[bot_name] -= 1
+            self.packlist_usage[packlist_name] -= 1
+            self.condition.notify_all()
+
+    def usage(self) -> dict:
+        """
+        Returns: slots in use in total, per bot and per packlist
+        """
+        with self.condition:
+            return {
+                'total': self.used(),
+                'bots': {bot: count for bot, count in self.bot_usage.items() if count},
+                'packlists': {packlist: count for packlist, count in self.packlist_usage.items() if count},
+                'waiting': len(self.waiting),
+            }
+
+
+budget = SlotBudget()
+
+def get() -> SlotBudget:
+    return budget
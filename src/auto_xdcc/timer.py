@@ -15,6 +15,26 @@ class Timer:
             self.unregister()
         self._timer = hexchat.hook_timer(self.interval, self.callback, userdata)
 
+    def reschedule(self, interval, userdata=None):
+        """
+        Hooks the timer with a new interval from within its callback, which must return False afterwards
+        """
+        self.interval = interval
+        self._timer = hexchat.hook_timer(self.interval, self.callback, userdata)
+
+    def register_once(self, userdata=None):
+        """
+        Calls the callback once after the interval, unless unregistered before that
+        """
+        def callback(data):
+            self._timer = None
+            self.callback(data)
+            return False
+
+        if self._timer is not None:
+            self.unregister()
+        self._timer = hexchat.hook_timer(self.interval, callback, userdata)
+
     def unregister(self):
         if self._timer is not None:
             hexchat.unhook(self._timer)
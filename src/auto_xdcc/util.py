@@ -1,34 +1,24 @@
-import hexchat
-
-
-def levenshtein(s1, s2):
-    """
-    Calculates edit distance between two strings using Levenshtein algorithm
-    https://en.wikibooks.org/wiki/Algorithm_Implementation/Strings/Levenshtein_distance#Python
-    """
-    if len(s1) < len(s2):
-        return levenshtein(s2, s1)
+import re
 
-    # len(s1) >= len(s2)
-    if len(s2) == 0:
-        return len(s1)
+import hexchat
 
-    previous_row = range(len(s2) + 1)
-    for i, c1 in enumerate(s1):
-        current_row = [i + 1]
-        for j, c2 in enumerate(s2):
-            insertions = previous_row[j + 1] + 1 # j+1 instead of j since previous_row and current_row are one character longer
-            deletions = current_row[j] + 1       # than s2
-            substitutions = previous_row[j] + (c1 != c2)
-            current_row.append(min(insertions, deletions, substitutions))
-        previous_row = current_row
+# Re-exported, the implementations do not depend on Hexchat
+from auto_xdcc.edit_distance import levenshtein, bounded_levenshtein
 
-    return previous_row[-1]
 
 def is_modified_filename(original_filename, modified_filename):
     # Count ' characters in original filename
     character_count = original_filename.count("'")
-    return levenshtein(original_filename, modified_filename) == character_count
+    return bounded_levenshtein(original_filename, modified_filename, character_count) == character_count
+
+# Characters which bots and Hexchat quote, replace or drop in offered filenames
+rewritten_characters = re.compile(r"['\" _]")
+
+def normalize_filename(filename):
+    """
+    Returns: filename without characters which may be rewritten in DCC offers
+    """
+    return rewritten_characters.sub('', filename)
 
 
 def get_dcc_completed_dir():
@@ -0,0 +1,45 @@
+import json
+import os
+import hashlib
+
+
+def file_hash(path: str) -> str:
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024**2), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class ValidatorStore:
+    """
+    Validators of a fetched packlist (ETag, Last-Modified, content hash), persisted next to the packlist file
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.data = ValidatorStore.load(path)
+
+    @staticmethod
+    def load(path: str) -> dict:
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, key: str, default=None):
+        return self.data.get(key, default)
+
+    def update(self, **values):
+        self.data.update(values)
+        self.persist()
+
+    def clear(self):
+        self.data = {}
+        self.persist()
+
+    def persist(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.data, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,112 @@
+import logging
+import time
+from typing import Dict, Optional
+
+# pylint: disable=E0401
+import hexchat
+
+import auto_xdcc.config as gconfig
+import auto_xdcc.download_manager as dm
+from auto_xdcc.timer import Timer
+
+
+class DownloadWatchdog:
+    """
+    Reclaims download slots of tasks which are stuck waiting for an offer, a connection or transfer progress.
+    Reclaimed tasks are cancelled and queued again after an exponential backoff.
+    """
+    def __init__(self, packlist_manager, request_timeout: int = 300, connect_timeout: int = 120, stall_timeout: int = 300,
+                    max_retries: int = 5, backoff_base: int = 60, backoff_max: int = 3600, interval: int = 30):
+        self.packlist_manager = packlist_manager
+        self.request_timeout = request_timeout
+        self.connect_timeout = connect_timeout
+        self.stall_timeout = stall_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timer = Timer(interval * 1000, self._check)
+        self.logger = logging.getLogger('watchdog')
+
+    @classmethod
+    def from_config(cls, packlist_manager, config: dict):
+        keys = {
+            'requestTimeout': 'request_timeout', 'connectTimeout': 'connect_timeout', 'stallTimeout': 'stall_timeout',
+            'maxRetries': 'max_retries', 'backoffBase': 'backoff_base', 'backoffMax': 'backoff_max', 'interval': 'interval'
+        }
+        return cls(packlist_manager, **{keys[key]: value for key, value in config.items() if key in keys})
+
+    def register(self):
+        self.timer.register()
+
+    def unregister(self):
+        self.timer.unregister()
+
+    def reclaimed_slots(self) -> int:
+        return sum(packlist.download_manager.reclaimed_slots for packlist in self.packlist_manager.packlists.values())
+
+    @staticmethod
+    def _transfers() -> Dict[str, int]:
+        """
+        Returns: received bytes of incoming DCC transfers by filename
+        """
+        transfers = {}
+        for item in hexchat.get_list('dcc') or ():
+            # Type 1 is an incoming file
+            if item.type == 1:
+                transfers[item.file] = (item.poshigh << 32) + (item.pos & 0xffffffff)
+        return transfers
+
+    def _stall_reason(self, task: dm.DownloadManager.Task, received: Optional[int], now: float) -> Optional[str]:
+        if task.status == dm.DOWNLOAD_REQUEST:
+            if task.is_batch_waiting():
+                # Bots send the packs of a batch one after another
+                task.state_since = now
+            elif now - task.state_since > self.request_timeout:
+                return 'no offer'
+        elif task.status == dm.DOWNLOAD_CONNECT:
+            if not received:
+                if now - task.state_since > self.connect_timeout:
+                    return 'no connection'
+            elif task.progress is None or task.progress[0] != received:
+                task.progress = (received, now)
+            elif now - task.progress[1] > self.stall_timeout:
+                return 'no progress'
+        return None
+
+    def _check(self, _userdata=None):
+        now = time.monotonic()
+        transfers = DownloadWatchdog._transfers()
+        for packlist in self.packlist_manager.packlists.values():
+            manager = packlist.download_manager
+            for task in manager.ongoing_tasks():
+                # Packlist requests have their own timeout
+                if task.task_type != 'regular':
+                    continue
+
+                received = transfers.get(task.filename) if task.filename else None
+                reason = self._stall_reason(task, received, now)
+                if reason:
+                    self._reclaim(manager, task, reason, received is not None)
+        gconfig.get().printer.flush()
+        return True
+
+    def _reclaim(self, manager: dm.DownloadManager, task: dm.DownloadManager.Task, reason: str, has_transfer: bool):
+        printer = gconfig.get().printer
+        item = task.item
+        if has_transfer:
+            hexchat.command("DCC CLOSE GET {} {}".format(task.bot_name, task.filename))
+        if not manager.reclaim_task(task):
+            return
+
+        attempts = task.attempts + 1
+        if attempts > self.max_retries:
+            self.logger.warning("Giving up download of %s after %d attempts: %s", item.filename, attempts, reason)
+            printer.error("Download of {} - {:02d} stalled ({}), giving up after {} attempts.".format(
+                item.show_name, item.episode_nr, reason, attempts
+            ))
+            return
+
+        delay = min(self.backoff_base * 2**task.attempts, self.backoff_max)
+        self.logger.info("Reclaimed slot of %s (%s), retrying in %ds", item.filename, reason, delay)
+        printer.info("Download of {} - {:02d} stalled ({}), retrying in {}s.".format(item.show_name, item.episode_nr, reason, delay))
+        Timer(delay * 1000, lambda _userdata: manager.requeue(task)).register_once()
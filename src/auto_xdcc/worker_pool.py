@@ -0,0 +1,46 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional, Set
+
+
+class WorkerPool:
+    """
+    Runs work in a thread pool created on first use.
+    Work which has not started is cancelled on terminate, running work should stop once stopping is set.
+    """
+    def __init__(self, workers: int, name: str):
+        self.workers = workers
+        self.name = name
+        self.pool: Optional[ThreadPoolExecutor] = None
+        # Submitted work which has not finished
+        self.pending: Set[Future] = set()
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+
+    def get_pool(self) -> ThreadPoolExecutor:
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+            return self.pool
+
+    def _submit(self, fn: Callable, *args) -> Future:
+        future = self.get_pool().submit(fn, *args)
+        with self.lock:
+            self.pending.add(future)
+        future.add_done_callback(self._discard)
+        return future
+
+    def _discard(self, future: Future):
+        with self.lock:
+            self.pending.discard(future)
+
+    def terminate(self):
+        self.stopping.set()
+        with self.lock:
+            pending = list(self.pending)
+            pool = self.pool
+        # shutdown(cancel_futures=True) requires Python 3.9
+        for future in pending:
+            future.cancel()
+        if pool is not None:
+            pool.shutdown(wait=False)
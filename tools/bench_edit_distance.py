@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Compares the full Levenshtein distance against the bounded one, as used by is_modified_filename,
+on release filenames of 80-150 characters.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+# pylint: disable=E0401,C0413
+from auto_xdcc.edit_distance import levenshtein, bounded_levenshtein
+
+
+words = ['Kimi', "no", "Hero's", 'Academia', 'Shingeki', 'Kyojin', "Frieren's", 'Journey', 'Beyond', 'Sousou',
+         'Tensei', 'Shitara', 'Slime', 'Datta', 'Ken', "Isekai", 'Ojisan', 'Mushoku', "Kaguya-sama", 'Love', 'War']
+
+def generate_filename(rng):
+    while True:
+        show_name = ' '.join(rng.choice(words) for _ in range(rng.randint(4, 12)))
+        filename = '[SubsPlease] {} - {:02d} (1080p) [{:08X}].mkv'.format(show_name, rng.randint(1, 24), rng.getrandbits(32))
+        if 80 <= len(filename) <= 150:
+            return filename
+
+
+def offered_filename(filename):
+    """Filename as offered by a bot, quotes dropped"""
+    return filename.replace("'", '')
+
+
+def measure(fn, pairs, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = [fn(original, offered) for original, offered in pairs]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(description="Edit distance benchmark.")
+    parser.add_argument('-n', '--count', help="Number of filename pairs.", type=int, default=2000)
+    parser.add_argument('-r', '--repeat', help="Number of runs, best is reported.", type=int, default=3)
+    parser.add_argument('-s', '--seed', help="Random seed.", type=int, default=0)
+    return parser
+
+
+def main():
+    args = argument_parser().parse_args()
+    rng = random.Random(args.seed)
+    filenames = [generate_filename(rng) for _ in range(args.count)]
+    # Offers of the same file and of other files, as compared when looking up a task
+    matching = [(filename, offered_filename(filename)) for filename in filenames]
+    other = [(filename, offered_filename(rng.choice(filenames))) for filename in filenames]
+
+    def full(original, offered):
+        return levenshtein(original, offered) == original.count("'")
+
+    def bounded(original, offered):
+        count = original.count("'")
+        return bounded_levenshtein(original, offered, count) == count
+
+    for name, pairs in (('matching', matching), ('other', other)):
+        full_time, full_result = measure(full, pairs, args.repeat)
+        bounded_time, bounded_result = measure(bounded, pairs, args.repeat)
+        if full_result != bounded_result:
+            print("Results differ for {} filenames".format(name))
+            sys.exit(1)
+
+        print("{:<9} full {:8.1f} us/pair  bounded {:6.1f} us/pair  {:6.0f}x".format(
+            name, full_time / len(pairs) * 1e6, bounded_time / len(pairs) * 1e6, full_time / bounded_time
+        ))
+
+
+if __name__ == '__main__':
+    main()
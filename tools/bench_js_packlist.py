@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Compares throughput of the JS packlist tokenizer against the earlier per-line regex and json.loads parser.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+# pylint: disable=E0401,C0413
+from auto_xdcc import packlist_parser
+from auto_xdcc.packlist_item import PacklistItem
+
+
+line_format = re.compile(r"(\{.*\})")
+unquoted_keys = re.compile(r'([^\{\}])\s*:')
+quote_keys = r'"\1":'
+
+def legacy_convert_line(line, keys):
+    """Per-line parser used before the tokenizer"""
+    stripped_line = re.search(line_format, line)
+    if stripped_line:
+        json_line = unquoted_keys.sub(quote_keys, stripped_line.group(0))
+        j = json.loads(json_line)
+        match = packlist_parser.file_format.fullmatch(j.get(keys['filename']))
+        if match:
+            filename, show_name, episode_nr, version, tags = match.groups()
+            if version:
+                version = int(version.strip('v'))
+
+            [resolution] = packlist_parser.process_tags(tags)
+            if resolution is None:
+                return None
+
+            return PacklistItem(
+                int(j.get(keys['packnumber'])), j.get(keys['size']),
+                filename, show_name, int(episode_nr), version, resolution
+            )
+    return None
+
+
+def generate_lines(count):
+    return [
+        'p.k[{0}] = {{b:"Bot|{1}", n:{2}, s:"{3}M", f:"[Group] Show {4} - {5:02d} [1080p].mkv"}};'.format(
+            i, i % 5, i + 1, i % 900 + 100, i % 3000, i % 24 + 1
+        )
+        for i in range(count)
+    ]
+
+
+def measure(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(description="JS packlist parser benchmark.")
+    parser.add_argument('-l', '--lines', help="Number of generated packlist lines.", type=int, default=100000)
+    parser.add_argument('-r', '--repeat', help="Number of runs, best is reported.", type=int, default=3)
+    return parser
+
+
+def main():
+    args = argument_parser().parse_args()
+    keys = {'bot_name': 'b', 'packnumber': 'n', 'size': 's', 'filename': 'f'}
+    lines = generate_lines(args.lines)
+    text = '\n'.join(lines)
+
+    legacy_time, legacy_items = measure(lambda: [legacy_convert_line(line, keys) for line in lines], args.repeat)
+    line_time, line_items = measure(lambda: [packlist_parser.convert_js_line(line, keys) for line in lines], args.repeat)
+    text_time, text_items = measure(lambda: list(packlist_parser.convert_js_text(text, keys)), args.repeat)
+
+    if not (legacy_items == line_items == text_items):
+        print("Parsers returned different items")
+        sys.exit(1)
+
+    size_mb = len(text.encode('utf-8')) / 1024**2
+    for name, elapsed in (('legacy per line', legacy_time), ('tokenizer per line', line_time), ('tokenizer one pass', text_time)):
+        print("{:<20} {:7.3f} s {:9.0f} lines/s {:7.1f} MB/s".format(name, elapsed, args.lines / elapsed, size_mb / elapsed))
+
+
+if __name__ == '__main__':
+    main()